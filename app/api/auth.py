@@ -4,7 +4,7 @@ from fastapi import HTTPException, status, Depends
 from fastapi.security import OAuth2PasswordBearer
 from config import ACCESS_TOKEN_EXPIRE_MINUTES, SECRET_KEY, ALGORITHM
 from app.auth.graph_auth import GraphAuth
-from app.services.supabase_service import supabase_service
+from app.services.supabase_service import async_supabase_service, supabase_service
 
 oauth2_scheme = OAuth2PasswordBearer(tokenUrl="token", auto_error=False)
 
@@ -33,7 +33,7 @@ async def get_current_graph(token: str = Depends(oauth2_scheme)):
     try:
         payload = jwt.decode(token, SECRET_KEY, algorithms=[ALGORITHM])
         email: str = payload.get("email")
-        user = supabase_service.get_user(email)
+        user = await async_supabase_service.get_user(email)
         if not user:
             access_token = payload.get("access_token")
             refresh_token: str = payload.get("refresh_token")
@@ -42,9 +42,16 @@ async def get_current_graph(token: str = Depends(oauth2_scheme)):
         if not refresh_token or not access_token or not email:
             raise credentials_exception
         graph_auth = GraphAuth(email=email, token=access_token, refresh_token=refresh_token)
-        is_valid_token = await graph_auth.validate_token(access_token)
+        is_valid_token = await graph_auth.check_token(access_token)
         if not is_valid_token:
-            raise credentials_exception
+            # The cached row may predate a refresh done by another process
+            supabase_service.invalidate_settings(email, 'user')
+            user = await async_supabase_service.get_user(email)
+            if not user or user["access_token"] == access_token:
+                raise credentials_exception
+            graph_auth = GraphAuth(email=email, token=user["access_token"], refresh_token=user["refresh_token"])
+            if not await graph_auth.check_token(user["access_token"]):
+                raise credentials_exception
         return graph_auth
 
     except Exception:
@@ -1,18 +1,26 @@
 # type: ignore
 
+import json
 from fastapi import APIRouter, Depends, HTTPException, File, UploadFile, Form, Body
+from fastapi.responses import StreamingResponse
 from pydantic import BaseModel
 from typing import Optional
+from datetime import date
 
 from app.api.auth import get_current_graph, create_jwt_token
-from app.auth.graph_auth import GraphAuth
-from app.services.email_service import EmailService
+from app.auth.graph_auth import GraphAPIError, GraphAuth
+from app.auth.graph_client import graph_client
+from app.services.activity_logger import activity_logger
+from app.services.email_service import EmailService, email_body_text, filter_personal_folders, folder_cache, folder_counts_cache
 from app.services.meeting_service import MeetingService
 from app.services.file_service import FileService
 from app.services.openai_service import openai_service
-from app.services.supabase_service import supabase_service
+from app.services.llm_dispatcher import llm_dispatcher
+from app.services.response_cache import response_cache
+from app.services.supabase_service import async_supabase_service, supabase_service
 from app.models.follow_up import FollowUpCreate
 from app.models.reply_template import ReplyTemplateCreate
+from app.models.schema import EmailRule
 from app.models.user import UserCreate
 
 class AutomationToggle(BaseModel):
@@ -36,25 +44,6 @@ router = APIRouter()
 # Initialize services
 file_service = FileService()
 
-default_mail_boxes = [
-    "Archive",
-    "Conversation History",
-    "Deleted Items",
-    "Drafts",
-    "Inbox",
-    "Junk Email",
-    "Outbox",
-    "RSS Feeds",
-    "Sent Items",
-    "Sync Issues",
-]
-
-def is_include_personal_folders(folders: list):
-    for folder in folders:
-        if folder["displayName"] not in default_mail_boxes:
-            return True
-    return False
-
 @router.post("/signin")
 async def signin(user: UserCreate):
     graph_auth = GraphAuth(user.email, user.access_token, user.refresh_token)
@@ -63,7 +52,7 @@ async def signin(user: UserCreate):
         raise HTTPException(status_code=401, detail="Invalid access token")
     email_service = EmailService(graph_auth)
     folders = await email_service.get_folders()
-    if not is_include_personal_folders(folders):
+    if not filter_personal_folders(folders, await email_service.get_default_folder_ids()):
         await email_service.create_folder("Urgent")
         await email_service.create_folder("Normal")
         await email_service.create_folder("Low Priority")
@@ -73,7 +62,7 @@ async def signin(user: UserCreate):
         "refresh_token": user.refresh_token,
     }
     access_token = create_jwt_token(data=data)
-    supabase_service.create_user(user)
+    await async_supabase_service.create_user(user)
     return { "access_token": access_token }
 
 @router.post("/verify-token")
@@ -97,6 +86,40 @@ async def get_emails(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/emails/stream")
+async def stream_emails(
+    folder: str = "inbox",
+    page_size: int = 50,
+    max_count: Optional[int] = None,
+    graph_auth: GraphAuth = Depends(get_current_graph)
+):
+    """Stream a folder's emails as NDJSON, one email per line, page by page.
+
+    Errors after the first page are reported as a final {"error": ...} line.
+    """
+    email_service = EmailService(graph_auth)
+    emails = email_service.iter_emails(folder, page_size, max_count)
+    # Fetch the first page up front so auth and folder errors get a proper status
+    try:
+        first = await anext(emails, None)
+    except GraphAPIError as e:
+        raise HTTPException(status_code=e.status_code, detail=str(e))
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+    async def generate():
+        if first is None:
+            return
+        yield first.model_dump_json() + "\n"
+        try:
+            async for email in emails:
+                yield email.model_dump_json() + "\n"
+        except Exception as e:
+            print(f"Error streaming emails: {e}")
+            yield json.dumps({"error": str(e)}) + "\n"
+
+    return StreamingResponse(generate(), media_type="application/x-ndjson")
+
 @router.get("/emails/{email_id}")
 async def get_email(email_id: str, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
@@ -113,8 +136,7 @@ async def get_draft_emails(
 ):
     try:
         email_service = EmailService(graph_auth)
-        folders = await email_service.get_folders()
-        drafts_folder = next((folder for folder in folders if folder["displayName"] == "Drafts"), None)
+        drafts_folder = await email_service.get_well_known_folder("drafts")
         if not drafts_folder:
             raise HTTPException(status_code=404, detail="Drafts folder not found")
         folder_id = drafts_folder["id"]
@@ -123,6 +145,20 @@ async def get_draft_emails(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/emails/delete")
+async def delete_emails(email_ids: list[str] = Body(..., embed=True), graph_auth: GraphAuth = Depends(get_current_graph)):
+    """Delete several emails through Graph $batch"""
+    try:
+        email_service = EmailService(graph_auth)
+        results = await email_service.delete_emails(email_ids)
+        failed = {email_id: str(result) for email_id, result in zip(email_ids, results) if isinstance(result, Exception)}
+        return {
+            "deleted": [email_id for email_id in email_ids if email_id not in failed],
+            "failed": failed
+        }
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 @router.delete("/emails/{email_id}")
 async def delete_email(email_id: str, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
@@ -136,8 +172,8 @@ async def delete_email(email_id: str, graph_auth: GraphAuth = Depends(get_curren
 async def count_inbox_mails(graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
         email_service = EmailService(graph_auth)
-        emails = await email_service.get_emails()
-        return len(emails)
+        counts = await email_service.get_folder_count("inbox")
+        return counts.get("totalItemCount", 0)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
@@ -145,11 +181,33 @@ async def count_inbox_mails(graph_auth: GraphAuth = Depends(get_current_graph)):
 async def count_draft_mails(graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
         email_service = EmailService(graph_auth)
-        emails = await email_service.get_emails(folder="drafts")
-        return len(emails)
+        counts = await email_service.get_folder_count("drafts")
+        return counts.get("totalItemCount", 0)
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/folder-counts")
+async def get_folder_counts(graph_auth: GraphAuth = Depends(get_current_graph)):
+    try:
+        email_service = EmailService(graph_auth)
+        counts = await email_service.get_folder_counts()
+        return {"folders": counts}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.get("/metrics")
+async def get_metrics():
+    """Process-wide cache and client counters for monitoring"""
+    return {
+        "graph": graph_client.stats(),
+        "settings_cache": supabase_service.cache.stats(),
+        "folder_cache": folder_cache.stats(),
+        "folder_counts_cache": folder_counts_cache.stats(),
+        "llm_cache": response_cache.stats(),
+        "llm": llm_dispatcher.stats(),
+        "activity_log": activity_logger.stats()
+    }
+
 # Add this to your routes.py
 @router.get("/test-graph")
 async def test_graph_connection(graph_auth: GraphAuth = Depends(get_current_graph)):
@@ -191,13 +249,30 @@ async def create_folder(
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
-# @router.post("/sort-emails")
-# async def sort_emails(rules: List[EmailRule]):
-#     try:
-#         results = await email_service.sort_emails(rules)
-#         return {"sorted_emails": results}
-#     except Exception as e:
-#         raise HTTPException(status_code=500, detail=str(e))
+# Sorting rules, applied before the learned classifier and the LLM
+@router.get("/rules")
+async def get_rules(graph_auth: GraphAuth = Depends(get_current_graph)):
+    try:
+        rules = await async_supabase_service.get_email_rules(graph_auth.email)
+        return rules
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.post("/rules")
+async def create_rule(rule: EmailRule, graph_auth: GraphAuth = Depends(get_current_graph)):
+    try:
+        new_rule = await async_supabase_service.create_email_rule(graph_auth.email, rule)
+        return new_rule
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
+@router.delete("/rules/{rule_id}")
+async def delete_rule(rule_id: str, graph_auth: GraphAuth = Depends(get_current_graph)):
+    try:
+        await async_supabase_service.delete_email_rule(graph_auth.email, rule_id)
+        return {"message": "Rule deleted successfully"}
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
 
 @router.post("/reply-email")
 async def reply_email(
@@ -339,8 +414,8 @@ async def analyze_email(email_id: str = Body(..., embed=True), graph_auth: Graph
         # Get email content
         email = await email_service.get_email_content(email_id)
         
-        # Extract the email body
-        email_content = email.get("body", {}).get("content", "")
+        # Extract the email's own text, without markup and quoted history
+        email_content = email_body_text(email)
         
         # Analyze the email
         analysis = await openai_service.analyze_email(email_content)
@@ -354,36 +429,94 @@ async def analyze_email(email_id: str = Body(..., embed=True), graph_auth: Graph
 async def chat(message: str = Body(...), graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
         email = graph_auth.email
-        response = await supabase_service.get_openai_response(email, message)
+        response = await async_supabase_service.get_openai_response(email, message)
         return {"response": response}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.post("/chat/stream")
+async def chat_stream(
+    message: str = Body(...),
+    format: str = "ndjson",
+    graph_auth: GraphAuth = Depends(get_current_graph)
+):
+    """Stream the chat response as it is generated
+    format: "ndjson" (one JSON object per line) | "sse" (text/event-stream)
+    Each delta is sent as {"delta": text}, followed by {"done": true, "response": full text}
+    """
+    if format not in ("ndjson", "sse"):
+        raise HTTPException(status_code=400, detail="format must be 'ndjson' or 'sse'")
+    email = graph_auth.email
+
+    def encode(event: str, payload: dict):
+        if format == "sse":
+            return f"event: {event}\ndata: {json.dumps(payload)}\n\n"
+        return json.dumps(payload) + "\n"
+
+    async def generate():
+        chunks = []
+        try:
+            async for delta in async_supabase_service.stream_openai_response(email, message):
+                chunks.append(delta)
+                yield encode("delta", {"delta": delta})
+            yield encode("done", {"done": True, "response": "".join(chunks)})
+        except Exception as e:
+            print(f"Error streaming chat response: {e}")
+            yield encode("error", {"error": str(e)})
+
+    media_type = "text/event-stream" if format == "sse" else "application/x-ndjson"
+    return StreamingResponse(generate(), media_type=media_type, headers={"Cache-Control": "no-cache"})
+
 @router.get("/chat-history")
-async def get_chat_history(graph_auth: GraphAuth = Depends(get_current_graph)):
+async def get_chat_history(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    graph_auth: GraphAuth = Depends(get_current_graph)
+):
     try:
         email = graph_auth.email
-        history = supabase_service.get_chat_history(email)
-        return {"history": history}
+        history, next_cursor = await async_supabase_service.get_chat_history(email, limit, cursor)
+        return {"history": history, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
 # Activity tracking endpoints
 @router.get("/activity-summary")
-async def get_activity_summary(graph_auth: GraphAuth = Depends(get_current_graph)):
+async def get_activity_summary(
+    since: Optional[date] = None,
+    until: Optional[date] = None,
+    graph_auth: GraphAuth = Depends(get_current_graph)
+):
     try:
         email = graph_auth.email
-        summary = supabase_service.get_activity_summary(email)
+        summary = await async_supabase_service.get_activity_summary(email, since, until)
         return summary
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
 
+@router.get("/activity-logs")
+async def get_activity_logs(
+    cursor: Optional[str] = None,
+    limit: Optional[int] = None,
+    graph_auth: GraphAuth = Depends(get_current_graph)
+):
+    try:
+        email = graph_auth.email
+        activities, next_cursor = await async_supabase_service.get_activity_logs(email, limit, cursor)
+        return {"activities": activities, "next_cursor": next_cursor}
+    except HTTPException:
+        raise
+    except Exception as e:
+        raise HTTPException(status_code=500, detail=str(e))
+
 # Settings endpoints
 @router.get("/schedules")
 async def get_schedules(graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
         email = graph_auth.email
-        schedules = supabase_service.get_schedules(email)
+        schedules = await async_supabase_service.get_schedules(email)
         return schedules
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -391,7 +524,7 @@ async def get_schedules(graph_auth: GraphAuth = Depends(get_current_graph)):
 @router.post("/schedules")
 async def add_schedule(schedule: FollowUpCreate, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        new_schedule = supabase_service.create_schedule(schedule)
+        new_schedule = await async_supabase_service.create_schedule(schedule)
         return new_schedule
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -399,7 +532,7 @@ async def add_schedule(schedule: FollowUpCreate, graph_auth: GraphAuth = Depends
 @router.put("/schedules/{schedule_id}")
 async def update_schedule(schedule_id: str, schedule: FollowUpCreate, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        updated_schedule = supabase_service.update_schedule(schedule_id, schedule)
+        updated_schedule = await async_supabase_service.update_schedule(schedule_id, schedule)
         return {"message": "Schedule updated successfully", "schedule": updated_schedule}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -407,7 +540,7 @@ async def update_schedule(schedule_id: str, schedule: FollowUpCreate, graph_auth
 @router.delete("/schedules/{schedule_id}")
 async def delete_schedule(schedule_id: str, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        supabase_service.delete_schedule(schedule_id)
+        await async_supabase_service.delete_schedule(schedule_id)
         return {"message": "Schedule deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -415,7 +548,7 @@ async def delete_schedule(schedule_id: str, graph_auth: GraphAuth = Depends(get_
 @router.get("/templates")
 async def get_templates(graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        templates = supabase_service.get_reply_templates(graph_auth.email)
+        templates = await async_supabase_service.get_reply_templates(graph_auth.email)
         return templates
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -423,7 +556,7 @@ async def get_templates(graph_auth: GraphAuth = Depends(get_current_graph)):
 @router.post("/templates")
 async def create_template(template: ReplyTemplateCreate, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        new_template = supabase_service.create_reply_template(template)
+        new_template = await async_supabase_service.create_reply_template(template)
         return new_template
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -431,7 +564,7 @@ async def create_template(template: ReplyTemplateCreate, graph_auth: GraphAuth =
 @router.put("/templates/{template_id}")
 async def update_template(template_id: str, template: ReplyTemplateCreate, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        updated_template = supabase_service.update_reply_template(template_id, template)
+        updated_template = await async_supabase_service.update_reply_template(template_id, template)
         return {"message": "Template updated successfully", "template": updated_template}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -439,7 +572,7 @@ async def update_template(template_id: str, template: ReplyTemplateCreate, graph
 @router.delete("/templates/{template_id}")
 async def delete_template(template_id: str, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        supabase_service.delete_reply_template(template_id)
+        await async_supabase_service.delete_reply_template(template_id)
         return {"message": "Template deleted successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -447,7 +580,7 @@ async def delete_template(template_id: str, graph_auth: GraphAuth = Depends(get_
 @router.post("/toggle-automation")
 async def toggle(toggle_data: AutomationToggle, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        supabase_service.toggle_user_automation(graph_auth.email, toggle_data.state)
+        await async_supabase_service.toggle_user_automation(graph_auth.email, toggle_data.state)
         return {"message": "Automation toggled successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
@@ -455,7 +588,7 @@ async def toggle(toggle_data: AutomationToggle, graph_auth: GraphAuth = Depends(
 @router.post("/subscription")
 async def update_subscription(subscription_data: SubscriptionUpdate, graph_auth: GraphAuth = Depends(get_current_graph)):
     try:
-        supabase_service.update_subscription(graph_auth.email, subscription_data.subscription)
+        await async_supabase_service.update_subscription(graph_auth.email, subscription_data.subscription)
         return {"message": "Subscription updated successfully"}
     except Exception as e:
         raise HTTPException(status_code=500, detail=str(e))
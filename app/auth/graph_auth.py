@@ -1,8 +1,98 @@
-import httpx
+import asyncio
+import json
+import threading
+import time
+import jwt
 import msal
 from fastapi import HTTPException
-from config import MS_CLIENT_ID, MS_TENANT_ID
-from app.services.supabase_service import supabase_service
+from config import (
+    GRAPH_BATCH_RETRIES,
+    GRAPH_BATCH_SIZE,
+    MS_CLIENT_ID,
+    MS_TENANT_ID,
+    TOKEN_EXPIRY_SKEW,
+    TOKEN_VALIDATION_TTL,
+)
+from app.auth.graph_client import GRAPH_BASE_URL, graph_client, is_retryable
+from app.services.supabase_service import async_supabase_service
+
+def decode_token_expiry(token: str):
+    """Return the `exp` claim of a JWT access token, or None for opaque tokens"""
+    try:
+        payload = jwt.decode(token, options={"verify_signature": False})
+        exp = payload.get("exp")
+        return float(exp) if exp else None
+    except Exception:
+        return None
+
+class GraphAPIError(Exception):
+    """A Graph call that failed with an HTTP error status"""
+
+    def __init__(self, status_code: int, text: str):
+        super().__init__(f"API error: {status_code} - {text}")
+        self.status_code = status_code
+        try:
+            # Graph error bodies look like {"error": {"code": "...", "message": "..."}}
+            self.code = json.loads(text)["error"]["code"]
+        except (ValueError, TypeError, KeyError):
+            self.code = None
+
+class TokenState:
+    """Per-user cache of the last access token known to be good.
+
+    A token is trusted until its known expiry (minus TOKEN_EXPIRY_SKEW) or,
+    for opaque tokens, for TOKEN_VALIDATION_TTL seconds after it was last
+    validated against Graph.
+    """
+
+    def __init__(self) -> None:
+        self._states = {}
+
+    def is_valid(self, email: str, token: str):
+        state = self._states.get(email)
+        if not state:
+            return False
+        cached_token, valid_until = state
+        return cached_token == token and time.time() < valid_until
+
+    def mark_valid(self, email: str, token: str, expires_at: float = None):
+        expiry = expires_at or decode_token_expiry(token)
+        if expiry is not None:
+            valid_until = expiry - TOKEN_EXPIRY_SKEW
+        else:
+            valid_until = time.time() + TOKEN_VALIDATION_TTL
+        self._states[email] = (token, valid_until)
+
+    def current_token(self, email: str):
+        """Return the user's latest known-good token, e.g. one refreshed by another request"""
+        state = self._states.get(email)
+        if state and time.time() < state[1]:
+            return state[0]
+        return None
+
+    def invalidate(self, email: str):
+        self._states.pop(email, None)
+
+token_state = TokenState()
+
+# MSAL applications (and their token caches) shared by every GraphAuth of a tenant
+_msal_apps = {}
+_msal_apps_lock = threading.Lock()
+
+# In-flight token refreshes, keyed by (event loop, email)
+_refreshes = {}
+
+def get_msal_app(authority: str):
+    with _msal_apps_lock:
+        app = _msal_apps.get(authority)
+        if app is None:
+            app = msal.PublicClientApplication(
+                MS_CLIENT_ID,
+                authority=authority,
+                token_cache=msal.SerializableTokenCache()
+            )
+            _msal_apps[authority] = app
+        return app
 
 class GraphAuth:
     def __init__(self, email: str, token: str, refresh_token: str = None):
@@ -18,51 +108,101 @@ class GraphAuth:
         self.refresh_token = refresh_token
         self.token = token
         self.email = email
-        self.app = msal.PublicClientApplication(MS_CLIENT_ID, authority=self.authority)
+        self.app = get_msal_app(self.authority)
 
     async def validate_token(self, token: str):
         if not token:
             raise HTTPException(detail="❌ Token is missing", status_code=404)
-        
-        async with httpx.AsyncClient() as client:
-            response = await client.get(
-                "https://graph.microsoft.com/v1.0/me",
-                headers={"Authorization": f"Bearer {token}"}
-            )
+
+        response = await graph_client.request(
+            self.email,
+            "GET",
+            f"{GRAPH_BASE_URL}/me",
+            headers={"Authorization": f"Bearer {token}"}
+        )
         if response.status_code == 200:
             print("✅ Token is valid")
+            token_state.mark_valid(self.email, token)
             return True
         else:
             print(f"❌ Token is invalid: {response.status_code} - {response.text}")
+            token_state.invalidate(self.email)
             return False
 
-    def get_new_token(self):
-        result = self.app.acquire_token_by_refresh_token(refresh_token=self.refresh_token, scopes=self.scopes)
+    async def check_token(self, token: str):
+        """Validate a token, skipping the Graph round trip while it is known good"""
+        if token_state.is_valid(self.email, token):
+            return True
+        expiry = decode_token_expiry(token) if token else None
+        if expiry is not None and time.time() < expiry - TOKEN_EXPIRY_SKEW:
+            token_state.mark_valid(self.email, token)
+            return True
+        return await self.validate_token(token)
+
+    async def get_new_token(self):
+        """Refresh the access token, sharing one in-flight refresh per user"""
+        key = (asyncio.get_running_loop(), self.email)
+        task = _refreshes.get(key)
+        if task is None:
+            task = asyncio.create_task(self._refresh_token())
+            _refreshes[key] = task
+            task.add_done_callback(lambda _: _refreshes.pop(key, None))
+        self.token = await asyncio.shield(task)
+        return self.token
+
+    async def _refresh_token(self):
+        result = await asyncio.to_thread(
+            self.app.acquire_token_by_refresh_token,
+            refresh_token=self.refresh_token,
+            scopes=self.scopes
+        )
 
         if "access_token" in result:
-            self.token = result["access_token"]
+            token = result["access_token"]
             print("✅ Generated new token successfully!")
-            supabase_service.update_access_token(self.email, self.token)
-            return self.token
+            expires_in = result.get("expires_in")
+            token_state.mark_valid(self.email, token, time.time() + int(expires_in) if expires_in else None)
+            await async_supabase_service.update_access_token(self.email, token)
+            return token
         else:
             raise Exception("❌ Could not get token: " + str(result))
-    
+
     async def get_headers(self):
-        token = self.token
-        is_valid_token = await self.validate_token(token)
+        # Pick up a token another request already refreshed for this user
+        token = token_state.current_token(self.email) or self.token
+        self.token = token
+        is_valid_token = await self.check_token(token)
         if not is_valid_token:
-            token = self.get_new_token()
+            token = await self.get_new_token()
         return {
             "Authorization": f"Bearer {token}",
             "Content-Type": "application/json"
         }
 
-    async def make_request(self, method, endpoint, data=None, params=None):
+    async def make_request(self, method, endpoint, data=None, params=None, headers=None):
+        extra_headers = headers
         headers = await self.get_headers()
-        url = f"https://graph.microsoft.com/v1.0/{endpoint}"
+        if extra_headers:
+            headers.update(extra_headers)
+        # Paging and delta links come back from Graph as absolute URLs
+        url = endpoint if endpoint.startswith("https://") else f"{GRAPH_BASE_URL}/{endpoint}"
 
-        async with httpx.AsyncClient() as client:
-            response = await client.request(
+        response = await graph_client.request(
+            self.email,
+            method=method,
+            url=url,
+            headers=headers,
+            json=data,
+            params=params
+        )
+
+        if response.status_code == 401:
+            # The cached token was revoked or expired early: refresh once and retry
+            print("❌ Token rejected by Graph, refreshing")
+            token_state.invalidate(self.email)
+            headers["Authorization"] = f"Bearer {await self.get_new_token()}"
+            response = await graph_client.request(
+                self.email,
                 method=method,
                 url=url,
                 headers=headers,
@@ -72,8 +212,69 @@ class GraphAuth:
 
         if response.status_code >= 400:
             print(f"❌ API Error: {response.status_code} - {response.text}")
-            raise Exception(f"API error: {response.status_code} - {response.text}")
+            raise GraphAPIError(response.status_code, response.text)
 
         if response.content and response.content.strip():
             return response.json()
         return None
+
+    async def batch(self, requests: list):
+        """Run Graph requests through JSON $batch, GRAPH_BATCH_SIZE per call.
+
+        Each request is a dict with "method", "url" (relative to /v1.0) and
+        optionally "body". Returns one result per request, in order: the
+        response body, or an Exception for items that failed. Items that
+        is_retryable allows (throttled, or a transient error on an idempotent
+        request) are retried up to GRAPH_BATCH_RETRIES times.
+        """
+        results = [None] * len(requests)
+        pending = list(range(len(requests)))
+        for attempt in range(GRAPH_BATCH_RETRIES + 1):
+            retry = []
+            retry_after = 0
+            for i in range(0, len(pending), GRAPH_BATCH_SIZE):
+                chunk = pending[i:i + GRAPH_BATCH_SIZE]
+                payload = {"requests": [self._batch_item(index, requests[index]) for index in chunk]}
+                try:
+                    response = await self.make_request("POST", "$batch", data=payload) or {}
+                except Exception as e:
+                    for index in chunk:
+                        results[index] = e
+                    continue
+
+                answered = set()
+                for item in response.get("responses", []):
+                    index = int(item["id"])
+                    answered.add(index)
+                    status = item.get("status", 500)
+                    if status < 400:
+                        results[index] = item.get("body")
+                        continue
+                    results[index] = GraphAPIError(status, str(item.get('body')))
+                    headers = {k.lower(): v for k, v in (item.get("headers") or {}).items()}
+                    item_retry_after = int(headers["retry-after"]) if str(headers.get("retry-after", "")).isdigit() else None
+                    if is_retryable(requests[index]["method"], status, item_retry_after):
+                        retry.append(index)
+                        retry_after = max(retry_after, item_retry_after or 0)
+                for index in chunk:
+                    if index not in answered:
+                        results[index] = GraphAPIError(500, "missing $batch response")
+
+            if not retry or attempt == GRAPH_BATCH_RETRIES:
+                break
+            print(f"Retrying {len(retry)} failed $batch item(s)")
+            await asyncio.sleep(retry_after or 2 ** attempt)
+            pending = retry
+
+        return results
+
+    def _batch_item(self, index: int, request: dict):
+        item = {
+            "id": str(index),
+            "method": request["method"],
+            "url": "/" + request["url"].lstrip("/")
+        }
+        if request.get("body") is not None:
+            item["body"] = request["body"]
+            item["headers"] = {"Content-Type": "application/json"}
+        return item
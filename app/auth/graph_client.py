@@ -0,0 +1,200 @@
+import asyncio
+import random
+import time
+from collections import Counter
+from email.utils import parsedate_to_datetime
+import httpx
+from config import (
+    GRAPH_KEEPALIVE_EXPIRY,
+    GRAPH_MAX_CONNECTIONS,
+    GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+    GRAPH_MAX_REQUESTS_PER_USER,
+    GRAPH_MAX_RETRIES,
+    GRAPH_RATE_BURST,
+    GRAPH_RATE_PER_SECOND,
+    GRAPH_TIMEOUT,
+)
+
+GRAPH_BASE_URL = "https://graph.microsoft.com/v1.0"
+
+# Statuses Graph uses to signal throttling or a transient outage
+RETRYABLE_STATUSES = (429, 503, 504)
+
+IDEMPOTENT_METHODS = frozenset({"GET", "HEAD", "OPTIONS", "PUT", "DELETE"})
+
+def is_retryable(method: str, status: int, retry_after: float = None):
+    """Whether a failed response can be retried without repeating a side effect.
+
+    A 504 (or a 503 without Retry-After) on a POST may already have been
+    applied, e.g. a reply sent, so non-idempotent requests are only retried
+    when Graph says they were throttled and not processed.
+    """
+    if method.upper() in IDEMPOTENT_METHODS:
+        return status in RETRYABLE_STATUSES
+    return status == 429 or (status == 503 and retry_after is not None)
+
+def parse_retry_after(response):
+    """Seconds to wait according to a Retry-After header, or None"""
+    value = response.headers.get("Retry-After")
+    if not value:
+        return None
+    try:
+        return max(0.0, float(value))
+    except ValueError:
+        pass
+    try:
+        return max(0.0, parsedate_to_datetime(value).timestamp() - time.time())
+    except (TypeError, ValueError):
+        return None
+
+class MailboxLimiter:
+    """Token-bucket rate limit plus adaptive concurrency for one mailbox.
+
+    The concurrency limit grows by about one per round of successful
+    requests up to GRAPH_MAX_REQUESTS_PER_USER and halves on every throttled
+    response (AIMD). A Retry-After pauses the whole mailbox.
+    """
+
+    def __init__(self) -> None:
+        self.tokens = float(GRAPH_RATE_BURST)
+        self.limit = float(GRAPH_MAX_REQUESTS_PER_USER)
+        self.active = 0
+        self.blocked_until = 0.0
+        self._updated = time.monotonic()
+        self._condition = asyncio.Condition()
+
+    def _refill(self, now: float):
+        self.tokens = min(GRAPH_RATE_BURST, self.tokens + (now - self._updated) * GRAPH_RATE_PER_SECOND)
+        self._updated = now
+
+    async def acquire(self):
+        async with self._condition:
+            while True:
+                now = time.monotonic()
+                self._refill(now)
+                if now < self.blocked_until:
+                    wait = self.blocked_until - now
+                elif self.active >= int(self.limit):
+                    wait = None
+                elif self.tokens < 1:
+                    wait = (1 - self.tokens) / GRAPH_RATE_PER_SECOND
+                else:
+                    self.tokens -= 1
+                    self.active += 1
+                    return
+                try:
+                    await asyncio.wait_for(self._condition.wait(), timeout=wait)
+                except asyncio.TimeoutError:
+                    pass
+
+    async def release(self, throttled: bool = False, retry_after: float = None):
+        async with self._condition:
+            self.active -= 1
+            if throttled:
+                self.limit = max(1.0, self.limit / 2)
+                if retry_after:
+                    self.blocked_until = max(self.blocked_until, time.monotonic() + retry_after)
+            else:
+                self.limit = min(float(GRAPH_MAX_REQUESTS_PER_USER), self.limit + 1 / self.limit)
+            self._condition.notify_all()
+
+class GraphClient:
+    """Process-wide pooled, keep-alive HTTP/2 client for Microsoft Graph.
+
+    One httpx client is kept per event loop so connections are reused across
+    every GraphAuth instance. Each mailbox goes through a MailboxLimiter, and
+    throttled (429/503/504) responses are retried up to GRAPH_MAX_RETRIES
+    times when is_retryable allows it, honoring Retry-After or backing off
+    exponentially with jitter.
+    """
+
+    def __init__(self) -> None:
+        self.counters = Counter()
+        self._clients = {}
+        self._limiters = {}
+
+    def _build_client(self):
+        return httpx.AsyncClient(
+            http2=True,
+            limits=httpx.Limits(
+                max_connections=GRAPH_MAX_CONNECTIONS,
+                max_keepalive_connections=GRAPH_MAX_KEEPALIVE_CONNECTIONS,
+                keepalive_expiry=GRAPH_KEEPALIVE_EXPIRY,
+            ),
+            timeout=httpx.Timeout(GRAPH_TIMEOUT),
+        )
+
+    def get_client(self):
+        loop = asyncio.get_running_loop()
+        client = self._clients.get(loop)
+        if client is None or client.is_closed:
+            client = self._build_client()
+            self._clients[loop] = client
+        return client
+
+    def _limiter(self, email: str):
+        key = (asyncio.get_running_loop(), email)
+        limiter = self._limiters.get(key)
+        if limiter is None:
+            limiter = MailboxLimiter()
+            self._limiters[key] = limiter
+        return limiter
+
+    async def request(self, email: str, method: str, url: str, **kwargs):
+        limiter = self._limiter(email)
+        for attempt in range(GRAPH_MAX_RETRIES + 1):
+            await limiter.acquire()
+            self.counters["requests"] += 1
+            try:
+                response = await self.get_client().request(method, url, **kwargs)
+            except httpx.ConnectError:
+                # Nothing reached Graph, so this is safe to retry for any method
+                await limiter.release()
+                self.counters["connect_errors"] += 1
+                if attempt == GRAPH_MAX_RETRIES:
+                    raise
+                self.counters["retries"] += 1
+                await asyncio.sleep(self._backoff(attempt))
+                continue
+            except BaseException:
+                await limiter.release()
+                raise
+
+            if response.status_code not in RETRYABLE_STATUSES:
+                await limiter.release()
+                return response
+
+            retry_after = parse_retry_after(response)
+            await limiter.release(throttled=True, retry_after=retry_after)
+            self.counters["throttled"] += 1
+            if attempt == GRAPH_MAX_RETRIES or not is_retryable(method, response.status_code, retry_after):
+                return response
+            self.counters["retries"] += 1
+            print(f"Graph throttled {email} ({response.status_code}), retrying")
+            await asyncio.sleep(retry_after if retry_after is not None else self._backoff(attempt))
+
+    def _backoff(self, attempt: int):
+        return min(30.0, 2 ** attempt) * (0.5 + random.random() / 2)
+
+    def stats(self):
+        limiters = list(self._limiters.values())
+        return {
+            "requests": self.counters["requests"],
+            "throttled": self.counters["throttled"],
+            "retries": self.counters["retries"],
+            "connect_errors": self.counters["connect_errors"],
+            "mailboxes": len(limiters),
+            "mailboxes_throttled": sum(1 for l in limiters if l.limit < GRAPH_MAX_REQUESTS_PER_USER),
+            "in_flight": sum(l.active for l in limiters)
+        }
+
+    async def close(self):
+        """Close the client bound to the running event loop"""
+        loop = asyncio.get_running_loop()
+        client = self._clients.pop(loop, None)
+        self._limiters = {k: v for k, v in self._limiters.items() if k[0] is not loop}
+        if client is not None and not client.is_closed:
+            await client.aclose()
+            print("✅ Graph client closed")
+
+graph_client = GraphClient()
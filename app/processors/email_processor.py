@@ -1,94 +1,193 @@
 import asyncio
 import os
 import random
+import time
 from datetime import datetime, timezone, timedelta
-from app.auth.graph_auth import GraphAuth
+from config import (
+    EMAIL_PAGE_SIZE,
+    EMAIL_SYNC_MODE,
+    PROCESSOR_MAX_CONCURRENCY,
+    PROCESSOR_PARTITIONING,
+    PROCESSOR_TICK,
+    PROCESSOR_USER_TIMEOUT,
+)
+from app.auth.graph_auth import GraphAPIError, GraphAuth
+from app.processors.partitioner import LeasePartitioner, StaticPartitioner
 from app.services.email_service import EmailService
-from app.services.supabase_service import supabase_service
+from app.services.ledger_service import message_ledger
+from app.services.supabase_service import async_supabase_service
 
 class EmailProcessor:
+    """Background automation loop over every user's inbox.
+
+    Users are scheduled independently: each one has its own next-due time,
+    at most one run per user is in flight, at most `max_concurrency` users
+    are processed at once (most overdue first), and a run that exceeds
+    `user_timeout` is cancelled so one slow mailbox cannot hold a slot.
+
+    When several workers run, each one only handles the users its
+    partitioner assigns to it (see app/processors/partitioner.py).
+    """
+
     def __init__(self) -> None:
         self.running = False
         self.check_interval = int(os.getenv("EMAIL_CHECK_INTERVAL", "10"))
-    
+        self.max_concurrency = PROCESSOR_MAX_CONCURRENCY
+        self.user_timeout = PROCESSOR_USER_TIMEOUT
+        self.next_due = {}
+        self.in_flight = {}
+        self.partitioner = LeasePartitioner() if PROCESSOR_PARTITIONING == "lease" else StaticPartitioner()
+
     async def start(self):
         if self.running:
             return
-        
+
         self.running = True
-        print("Starting email processor")
+        print(f"Starting email processor ({self.partitioner.worker_id})")
+        users = []
+        users_loaded_at = None
         while self.running:
-            users = supabase_service.get_all_users()
-            if not users:
-                print('No users')
-                await asyncio.sleep(self.check_interval)
+            now = time.monotonic()
+            if users_loaded_at is None or now - users_loaded_at >= self.check_interval:
+                try:
+                    users = await async_supabase_service.get_all_users() or []
+                except Exception as e:
+                    print(f"Error loading users: {e}")
+                users_loaded_at = now
+                if not users:
+                    print('No users')
+                known = {user["email"] for user in users}
+                self.next_due = {email: due for email, due in self.next_due.items() if email in known}
+
+            await self.partitioner.heartbeat()
+            self.dispatch(users, now)
+            await asyncio.sleep(PROCESSOR_TICK)
+
+        if self.in_flight:
+            await asyncio.gather(*self.in_flight.values(), return_exceptions=True)
+        await self.partitioner.release()
+
+    def dispatch(self, users: list, now: float):
+        """Start runs for due users while concurrency slots are free"""
+        due = [
+            user for user in users
+            if user["email"] not in self.in_flight
+            and self.next_due.get(user["email"], 0) <= now
+            and self.partitioner.owns(user["email"])
+        ]
+        due.sort(key=lambda user: self.next_due.get(user["email"], 0))
+        for user in due:
+            if len(self.in_flight) >= self.max_concurrency:
+                break
+            email = user["email"]
+            if not user["automation"]:
+                self.next_due[email] = now + self.check_interval
                 continue
+            task = asyncio.create_task(self.run_user(user))
+            self.in_flight[email] = task
+            task.add_done_callback(lambda _, email=email: self.finish_user(email))
 
-            for user in users:
-                try:
-                    email = user["email"]
-                    access_token = user["access_token"]
-                    refresh_token = user["refresh_token"]
-                    settings_on = user["automation"]
-                    if not settings_on:
-                        print('Automation is off')
-                        continue
-                    graph_auth = GraphAuth(user["email"], access_token, refresh_token)
-                    email_service = EmailService(graph_auth)
-                    folders = await email_service.get_folders()
-                    if not folders:
-                        print('No folders')
-                        continue
-                    folder = next((f for f in folders if f["displayName"].lower() == 'inbox'), None)
-                    if not folder:
-                        print('No inbox folder')
-                        continue
-
-                    followup_schedules = supabase_service.get_schedules(email)
-                    templates = supabase_service.get_reply_templates(email)
-                    emails = await email_service.get_emails(folder["id"])
-                    print(f"{len(emails)} emails found.")
-                    for email in emails:
-                        if email.is_read:
-                            continue
-                        try:
-                            print("Replying email")
-                            await email_service.send_reply(
-                                email_id=email.id,
-                                template=templates[random.randint(0, len(templates) - 1)],
-                                send_without_approval=False
-                            )
-                        except Exception as e:
-                            print(e)
-                        try:
-                            print("Setting flag")
-                            for schedule in followup_schedules:
-                                days = schedule["days"]
-                                reminder_date = datetime.now(timezone.utc) + timedelta(days=days)
-                                await email_service.set_follow_up(
-                                    email_id=email.id,
-                                    reminder_date=reminder_date
-                                )
-                        except Exception as e:
-                            print(e)
-
-                    print("Sorting emails")
-                    try:
-                        await email_service.sort_emails(folders, emails)
-                    except Exception as e:
-                        print(e)
-
-                    del emails
-                    del graph_auth
-                    del email_service
+    def finish_user(self, email: str):
+        self.in_flight.pop(email, None)
+        self.next_due[email] = time.monotonic() + self.check_interval
 
+    async def run_user(self, user: dict):
+        try:
+            await asyncio.wait_for(self.process_user(user), timeout=self.user_timeout)
+        except asyncio.TimeoutError:
+            print(f"Processing user {user['email']} timed out after {self.user_timeout}s")
+        except Exception as e:
+            print(f"Error processing user {user['email']}: {e}")
+
+    async def process_user(self, user: dict):
+        email = user["email"]
+        access_token = user["access_token"]
+        refresh_token = user["refresh_token"]
+        graph_auth = GraphAuth(email, access_token, refresh_token)
+        email_service = EmailService(graph_auth)
+        folder = await email_service.get_well_known_folder("inbox")
+        if not folder:
+            print('No inbox folder')
+            return
+        folders = await email_service.get_folders()
+        if not folders:
+            print('No folders')
+            return
+
+        followup_schedules = await async_supabase_service.get_schedules(email)
+        templates = await async_supabase_service.get_reply_templates(email)
+        emails, delta_link = await self.fetch_emails(email, email_service, folder["id"])
+        print(f"{len(emails)} emails found.")
+        unread_ids = [message.id for message in emails if not message.is_read]
+        to_reply = set(await message_ledger.filter_unprocessed(email, unread_ids, "send_reply"))
+        to_follow_up = set(await message_ledger.filter_unprocessed(email, unread_ids, "set_follow_up"))
+        # A delta link is only saved when every action succeeded: the next
+        # delta query returns changed messages only, so a message whose action
+        # failed would otherwise never be retried
+        complete = True
+        for message in emails:
+            if message.is_read:
+                continue
+            if message.id in to_reply and templates:
+                try:
+                    print("Replying email")
+                    await email_service.send_reply(
+                        email_id=message.id,
+                        template=templates[random.randint(0, len(templates) - 1)],
+                        send_without_approval=False
+                    )
+                    await message_ledger.mark_processed(email, message.id, "send_reply")
                 except Exception as e:
-                    print(f"Error processing user {email}: {e}")
-                    continue
+                    complete = False
+                    print(e)
+
+        follow_up_ids = [message.id for message in emails if not message.is_read and message.id in to_follow_up]
+        if follow_up_ids:
+            try:
+                print("Setting flags")
+                failed = set()
+                for schedule in followup_schedules:
+                    days = schedule["days"]
+                    reminder_date = datetime.now(timezone.utc) + timedelta(days=days)
+                    results = await email_service.set_follow_ups(follow_up_ids, reminder_date)
+                    failed.update(message_id for message_id, result in zip(follow_up_ids, results) if isinstance(result, Exception))
+                for message_id in follow_up_ids:
+                    if message_id not in failed:
+                        await message_ledger.mark_processed(email, message_id, "set_follow_up")
+                complete = complete and not failed
+            except Exception as e:
+                complete = False
+                print(e)
+
+        print("Sorting emails")
+        try:
+            to_sort = set(await message_ledger.filter_unprocessed(email, [message.id for message in emails], "sort_email"))
+            sorted_emails = await email_service.sort_emails(folders, [message for message in emails if message.id in to_sort])
+            for result in sorted_emails:
+                await message_ledger.mark_processed(email, result["id"], "sort_email")
+            complete = complete and len(sorted_emails) == len(to_sort)
+        except Exception as e:
+            complete = False
+            print(e)
+
+        if delta_link and complete:
+            await async_supabase_service.save_delta_link(email, folder["id"], delta_link)
+
+    async def fetch_emails(self, email: str, email_service: EmailService, folder_id: str):
+        """Fetch the emails to process this tick and the delta link to persist afterwards"""
+        if EMAIL_SYNC_MODE != "delta":
+            return await email_service.get_emails(folder_id, max_count=EMAIL_PAGE_SIZE), None
+
+        delta_link = await async_supabase_service.get_delta_link(email, folder_id)
+        try:
+            return await email_service.get_email_changes(folder_id, delta_link)
+        except GraphAPIError as e:
+            if not delta_link or not (e.status_code == 410 or e.code in ("SyncStateNotFound", "SyncStateInvalid")):
+                raise
+            # The delta token expired: start a fresh sync
+            print(f"Delta token expired for {email}, resyncing")
+            return await email_service.get_email_changes(folder_id)
 
-            del users
-            await asyncio.sleep(self.check_interval)
-        
     def stop(self):
         print("Stopping email processor")
         self.running = False
@@ -0,0 +1,94 @@
+import bisect
+import hashlib
+import os
+import socket
+import time
+import uuid
+import zlib
+from config import (
+    LEASE_HEARTBEAT_INTERVAL,
+    LEASE_TTL,
+    LEASE_VIRTUAL_NODES,
+    WORKER_COUNT,
+    WORKER_ID,
+    WORKER_INDEX,
+)
+from app.services.supabase_service import async_supabase_service
+
+def ring_hash(key: str):
+    return int.from_bytes(hashlib.md5(key.encode()).digest()[:8], "big")
+
+class StaticPartitioner:
+    """Fixed partitioning by WORKER_INDEX out of WORKER_COUNT"""
+
+    def __init__(self) -> None:
+        self.worker_id = f"{WORKER_INDEX + 1}/{WORKER_COUNT}"
+
+    async def heartbeat(self):
+        pass
+
+    def owns(self, email: str):
+        if WORKER_COUNT <= 1:
+            return True
+        return zlib.crc32(email.lower().encode()) % WORKER_COUNT == WORKER_INDEX
+
+    async def release(self):
+        pass
+
+class LeasePartitioner:
+    """Consistent-hash partitioning across the workers holding a live lease.
+
+    Every worker renews its row in `processor_leases` each
+    LEASE_HEARTBEAT_INTERVAL seconds and builds a hash ring from the workers
+    seen within LEASE_TTL. A user belongs to the worker owning the ring point
+    after the hash of their email, so when a worker joins or dies only its
+    share of users moves. A worker owns no users until its first successful
+    heartbeat, nor once LEASE_TTL has passed since the last one, because by
+    then the other workers have dropped it from their rings.
+    """
+
+    def __init__(self) -> None:
+        self.worker_id = WORKER_ID or f"{socket.gethostname()}-{os.getpid()}-{uuid.uuid4().hex[:6]}"
+        self.workers = [self.worker_id]
+        self.last_heartbeat = None
+        self.renewed_at = None
+        self._build_ring()
+
+    def _build_ring(self):
+        points = []
+        for worker_id in self.workers:
+            for i in range(LEASE_VIRTUAL_NODES):
+                points.append((ring_hash(f"{worker_id}#{i}"), worker_id))
+        points.sort()
+        self._hashes = [point[0] for point in points]
+        self._owners = [point[1] for point in points]
+
+    async def heartbeat(self):
+        now = time.monotonic()
+        if self.last_heartbeat is not None and now - self.last_heartbeat < LEASE_HEARTBEAT_INTERVAL:
+            return
+        self.last_heartbeat = now
+        try:
+            await async_supabase_service.renew_processor_lease(self.worker_id)
+            live = await async_supabase_service.get_live_processor_leases(LEASE_TTL)
+        except Exception as e:
+            print(f"Error renewing processor lease: {e}")
+            return
+        self.renewed_at = now
+        workers = sorted(set(live) | {self.worker_id})
+        if workers != self.workers:
+            print(f"Rebalancing users across {len(workers)} processor(s)")
+            self.workers = workers
+            self._build_ring()
+
+    def owns(self, email: str):
+        if self.renewed_at is None or time.monotonic() - self.renewed_at >= LEASE_TTL:
+            return False
+        index = bisect.bisect(self._hashes, ring_hash(email.lower())) % len(self._hashes)
+        return self._owners[index] == self.worker_id
+
+    async def release(self):
+        try:
+            await async_supabase_service.release_processor_lease(self.worker_id)
+        except Exception as e:
+            print(f"Error releasing processor lease: {e}")
@@ -0,0 +1,29 @@
+"""Standalone email processor worker.
+
+Run with `python -m app.processors.worker`, and set PROCESSOR_MODE=worker on
+the API servers so they don't run the processor themselves. To scale out,
+either start N workers with PROCESSOR_PARTITIONING=lease, which split users
+through heartbeat leases and rebalance when one dies, or with WORKER_COUNT=N
+and a distinct WORKER_INDEX (0..N-1) each.
+"""
+import asyncio
+import signal
+from app.auth.graph_client import graph_client
+from app.processors.email_processor import email_processor
+from app.services.activity_logger import activity_logger
+from app.utils.content import load_encodings
+
+async def main():
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, email_processor.stop)
+    await asyncio.to_thread(load_encodings)
+    await activity_logger.start()
+    try:
+        await email_processor.start()
+    finally:
+        await activity_logger.stop()
+        await graph_client.close()
+
+if __name__ == "__main__":
+    asyncio.run(main())
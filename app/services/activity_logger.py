@@ -0,0 +1,153 @@
+import asyncio
+import json
+import os
+from collections import deque
+from datetime import datetime, timezone
+from config import (
+    ACTIVITY_LOG_BATCH_SIZE,
+    ACTIVITY_LOG_FLUSH_INTERVAL,
+    ACTIVITY_LOG_MAX_BUFFER,
+    ACTIVITY_LOG_SPOOL_PATH,
+)
+from app.services.supabase_service import async_supabase_service
+
+class ActivityLogger:
+    """Buffers activity log events in memory and writes them in bulk inserts.
+
+    Events are flushed once ACTIVITY_LOG_BATCH_SIZE of them are waiting or
+    every ACTIVITY_LOG_FLUSH_INTERVAL seconds, and on shutdown. At most
+    ACTIVITY_LOG_MAX_BUFFER events are held; the oldest are dropped beyond
+    that, including after a failed flush. If ACTIVITY_LOG_SPOOL_PATH is set,
+    unflushed events are also kept in that file and replayed on the next
+    start; the file is only written by flush, off the event loop.
+    """
+
+    def __init__(self) -> None:
+        self.dropped = 0
+        self._buffer = deque(maxlen=ACTIVITY_LOG_MAX_BUFFER)
+        self._unspooled = deque(maxlen=ACTIVITY_LOG_MAX_BUFFER)
+        self._lock = asyncio.Lock()
+        self._wakeup = None
+        self._task = None
+
+    def log(self, email: str, activity: str, details: str = ''):
+        """Queue an activity log event
+        activity: "sort_email" | "send_reply" | "send_reply_manual" | "set_follow_up" | "process_file" | "join_meeting"
+        """
+        event = {
+            'user_mail': email,
+            'activity': activity,
+            'details': details,
+            'timestamp': datetime.now(timezone.utc).isoformat()
+        }
+        if len(self._buffer) == self._buffer.maxlen:
+            self.dropped += 1
+        self._buffer.append(event)
+        if ACTIVITY_LOG_SPOOL_PATH:
+            self._unspooled.append(event)
+        if self._wakeup and len(self._buffer) >= ACTIVITY_LOG_BATCH_SIZE:
+            self._wakeup.set()
+
+    async def start(self):
+        if self._task:
+            return
+        await self._replay_spool()
+        self._wakeup = asyncio.Event()
+        self._task = asyncio.create_task(self._run())
+
+    async def stop(self):
+        if self._task:
+            self._task.cancel()
+            try:
+                await self._task
+            except asyncio.CancelledError:
+                pass
+            self._task = None
+        await self.flush()
+
+    async def _run(self):
+        while True:
+            try:
+                await asyncio.wait_for(self._wakeup.wait(), timeout=ACTIVITY_LOG_FLUSH_INTERVAL)
+            except asyncio.TimeoutError:
+                pass
+            self._wakeup.clear()
+            try:
+                await self.flush()
+            except Exception as e:
+                # Keep the flusher alive; the buffer is retried on the next round
+                print(f"Error in activity log flush: {e}")
+
+    async def flush(self):
+        async with self._lock:
+            if self._unspooled:
+                # Spool new events before the insert, so a crash mid-flush keeps them
+                events = list(self._unspooled)
+                self._unspooled.clear()
+                try:
+                    await asyncio.to_thread(self._append_spool, events)
+                except OSError as e:
+                    print(f"Error spooling activity logs: {e}")
+            while self._buffer:
+                batch = [self._buffer.popleft() for _ in range(min(ACTIVITY_LOG_BATCH_SIZE, len(self._buffer)))]
+                try:
+                    await async_supabase_service.log_activities(batch)
+                except asyncio.CancelledError:
+                    self._requeue(batch)
+                    raise
+                except Exception as e:
+                    print(f"Error flushing activity logs: {e}")
+                    self._requeue(batch)
+                    break
+            if ACTIVITY_LOG_SPOOL_PATH:
+                # Events logged from here on are appended by the next flush
+                events = list(self._buffer)
+                self._unspooled.clear()
+                try:
+                    await asyncio.to_thread(self._rewrite_spool, events)
+                except OSError as e:
+                    print(f"Error rewriting activity log spool: {e}")
+
+    def stats(self):
+        return {"buffered": len(self._buffer), "dropped": self.dropped}
+
+    def _requeue(self, batch: list):
+        """Put a failed batch back in front of newer events, dropping the oldest if the buffer is full"""
+        overflow = len(batch) + len(self._buffer) - ACTIVITY_LOG_MAX_BUFFER
+        if overflow > 0:
+            self.dropped += overflow
+        self._buffer = deque(batch + list(self._buffer), maxlen=ACTIVITY_LOG_MAX_BUFFER)
+
+    async def _replay_spool(self):
+        if not ACTIVITY_LOG_SPOOL_PATH:
+            return
+        events = await asyncio.to_thread(self._read_spool)
+        self._buffer = deque(events + list(self._buffer), maxlen=ACTIVITY_LOG_MAX_BUFFER)
+        if events:
+            print(f"Replaying {len(events)} spooled activity logs")
+
+    def _read_spool(self):
+        if not os.path.exists(ACTIVITY_LOG_SPOOL_PATH):
+            return []
+        events = []
+        with open(ACTIVITY_LOG_SPOOL_PATH, "r", encoding="utf-8") as f:
+            for line in f:
+                try:
+                    events.append(json.loads(line))
+                except ValueError:
+                    continue
+        return events
+
+    def _append_spool(self, events: list):
+        with open(ACTIVITY_LOG_SPOOL_PATH, "a", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+
+    def _rewrite_spool(self, events: list):
+        tmp_path = ACTIVITY_LOG_SPOOL_PATH + ".tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            for event in events:
+                f.write(json.dumps(event) + "\n")
+        os.replace(tmp_path, ACTIVITY_LOG_SPOOL_PATH)
+
+activity_logger = ActivityLogger()
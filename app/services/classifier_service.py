@@ -0,0 +1,147 @@
+import math
+import re
+from config import CLASSIFIER_CONFIDENCE, CLASSIFIER_MAX_FEATURES, CLASSIFIER_MIN_SAMPLES, CLASSIFIER_MODEL_TTL
+from app.models.schema import EmailMessage
+from app.services.supabase_service import async_supabase_service
+from app.utils.cache import TTLCache
+
+TOKEN_PATTERN = re.compile(r"[a-z0-9]+")
+
+def email_features(email: EmailMessage):
+    """Sender, sender domain and subject uni/bigram features of an email"""
+    features = []
+    sender = (email.sender or "").lower()
+    if sender:
+        features.append(f"sender:{sender}")
+        features.append(f"domain:{sender.rsplit('@', 1)[-1]}")
+    tokens = TOKEN_PATTERN.findall((email.subject or "").lower())
+    features.extend(f"w:{token}" for token in tokens)
+    features.extend(f"b:{a}_{b}" for a, b in zip(tokens, tokens[1:]))
+    if "unsubscribe" in (email.body or "").lower():
+        features.append("list:unsubscribe")
+    return features
+
+def match_rule(rule: dict, email: EmailMessage):
+    """Whether a user EmailRule (field, value) matches an email, case-insensitively"""
+    values = {
+        "subject": email.subject,
+        "from": email.sender,
+        "sender": email.sender,
+        "body": email.body,
+    }
+    text = values.get((rule.get("field") or "").lower())
+    return bool(text and rule.get("value") and rule["value"].lower() in text.lower())
+
+class SortModel:
+    """Multinomial naive Bayes over email features, i.e. a linear model in log space"""
+
+    def __init__(self, state: dict = None) -> None:
+        state = state or {}
+        self.class_counts = state.get("class_counts", {})
+        self.feature_counts = state.get("feature_counts", {})
+        self._stats = None
+
+    @property
+    def samples(self):
+        return sum(self.class_counts.values())
+
+    def learn(self, email: EmailMessage, folder_id: str):
+        self._stats = None
+        self.class_counts[folder_id] = self.class_counts.get(folder_id, 0) + 1
+        counts = self.feature_counts.setdefault(folder_id, {})
+        for feature in email_features(email):
+            counts[feature] = counts.get(feature, 0) + 1
+        if len(counts) > CLASSIFIER_MAX_FEATURES:
+            # Drop the rarest features so the model stays bounded
+            keep = sorted(counts.items(), key=lambda item: item[1], reverse=True)[:CLASSIFIER_MAX_FEATURES // 2]
+            self.feature_counts[folder_id] = dict(keep)
+
+    def stats(self):
+        """Vocabulary size and per-folder feature totals, computed once until the model learns again"""
+        if self._stats is None:
+            vocabulary = len({feature for counts in self.feature_counts.values() for feature in counts}) or 1
+            totals = {folder_id: sum(counts.values()) for folder_id, counts in self.feature_counts.items()}
+            self._stats = vocabulary, totals
+        return self._stats
+
+    def predict(self, email: EmailMessage, folder_ids: set):
+        """Return (folder id, posterior probability) of the most likely known folder"""
+        classes = [folder_id for folder_id in self.class_counts if folder_id in folder_ids]
+        if not classes:
+            return None, 0.0
+        features = email_features(email)
+        vocabulary, totals = self.stats()
+        total = sum(self.class_counts[folder_id] for folder_id in classes)
+        scores = {}
+        for folder_id in classes:
+            counts = self.feature_counts.get(folder_id, {})
+            denominator = totals.get(folder_id, 0) + vocabulary
+            score = math.log(self.class_counts[folder_id] / total)
+            for feature in features:
+                score += math.log((counts.get(feature, 0) + 1) / denominator)
+            scores[folder_id] = score
+        best = max(scores, key=scores.get)
+        normalizer = sum(math.exp(score - scores[best]) for score in scores.values())
+        return best, 1 / normalizer
+
+    def to_dict(self):
+        return {"class_counts": self.class_counts, "feature_counts": self.feature_counts}
+
+class ClassifierService:
+    """Local fast path for sorting: user rules first, then the learned model.
+
+    Only confident answers are returned; everything else goes to the LLM,
+    whose decisions are fed back into the model. Models are cached for
+    CLASSIFIER_MODEL_TTL so a worker picks up what other workers learned
+    for the same user, and only the counts learned in a run are sent to the
+    database, which adds them to the stored model.
+    """
+
+    def __init__(self) -> None:
+        self._models = TTLCache(maxsize=10000, ttl=CLASSIFIER_MODEL_TTL)
+
+    async def _get_model(self, email: str):
+        model = self._models.get(email)
+        if model is None:
+            model = SortModel(await async_supabase_service.get_classifier_model(email))
+            self._models.set(email, model)
+        return model
+
+    async def classify(self, email: str, emails: list, folder_index: list, folders: dict):
+        """Return a dict of email id to folder id for the emails that can be sorted locally
+        folder_index: the candidate folders the model may pick from
+        folders: every folder indexed by id ("by_id") and lower-cased name ("by_name");
+        a rule may target any of them, including default folders such as Archive
+        """
+        folder_ids = {folder["id"] for folder in folder_index}
+        rules = await async_supabase_service.get_email_rules(email)
+        model = await self._get_model(email)
+
+        targets = {}
+        for message in emails:
+            rule = next((rule for rule in rules if match_rule(rule, message)), None)
+            if rule:
+                target = rule["target_folder"]
+                folder = folders["by_id"].get(target) or folders["by_name"].get(target.lower())
+                if folder:
+                    targets[message.id] = folder["id"]
+                    continue
+            if model.samples < CLASSIFIER_MIN_SAMPLES:
+                continue
+            target, confidence = model.predict(message, folder_ids)
+            if target and confidence >= CLASSIFIER_CONFIDENCE:
+                targets[message.id] = target
+        return targets
+
+    async def learn(self, email: str, moves: list):
+        """Train the user's model on (EmailMessage, folder id) pairs and persist what was learned"""
+        if not moves:
+            return
+        model = await self._get_model(email)
+        delta = SortModel()
+        for message, folder_id in moves:
+            model.learn(message, folder_id)
+            delta.learn(message, folder_id)
+        await async_supabase_service.merge_classifier_model(email, delta.to_dict(), CLASSIFIER_MAX_FEATURES)
+
+classifier_service = ClassifierService()
@@ -1,10 +1,23 @@
 import json
 import os
-from datetime import datetime
-from app.auth.graph_auth import GraphAuth
+from datetime import datetime, timedelta, timezone
+from config import (
+    EMAIL_CONTENT_MAX_TOKENS,
+    EMAIL_DELTA_INITIAL_DAYS,
+    EMAIL_DELTA_PAGE_SIZE,
+    EMAIL_PAGE_SIZE,
+    FOLDER_CACHE_TTL,
+    FOLDER_COUNTS_TTL,
+    SORT_BATCH_SIZE,
+)
+from app.auth.graph_auth import GraphAPIError, GraphAuth
 from app.models.schema import EmailMessage
+from app.services.llm_dispatcher import BACKGROUND
 from app.services.openai_service import openai_service
-from app.services.supabase_service import supabase_service
+from app.utils.cache import TTLCache
+from app.utils.content import prepare_email_content
+from app.services.activity_logger import activity_logger
+from app.services.classifier_service import classifier_service
 
 default_mail_boxes = [
     "Archive",
@@ -19,10 +32,68 @@ default_mail_boxes = [
     "Sync Issues",
 ]
 
-def filter_personal_folders(folders: list):
+# Graph well-known names of the default folders, which sorting must never target
+WELL_KNOWN_FOLDERS = [
+    "archive",
+    "conversationhistory",
+    "deleteditems",
+    "drafts",
+    "inbox",
+    "junkemail",
+    "outbox",
+    "sentitems",
+    "syncissues",
+]
+
+# Per-user folder lists and well-known folders; counts change often, so they
+# are cached separately and only briefly
+folder_cache = TTLCache(maxsize=10000, ttl=FOLDER_CACHE_TTL)
+folder_counts_cache = TTLCache(maxsize=10000, ttl=FOLDER_COUNTS_TTL)
+
+EMAIL_SELECT_FIELDS = "id,subject,bodyPreview,from,toRecipients,ccRecipients,receivedDateTime,importance,isRead,hasAttachments"
+
+def parse_email(item: dict):
+    """Convert a Graph message resource into an EmailMessage"""
+    sender = item["from"]["emailAddress"]["address"] if "from" in item and "emailAddress" in item["from"] else None
+    received = item.get("receivedDateTime")
+    return EmailMessage(
+        id=item["id"],
+        subject=item.get("subject") or "",
+        body=item.get("bodyPreview") or "",
+        to_recipients=[r["emailAddress"]["address"] for r in item.get("toRecipients", [])],
+        importance=item.get("importance", "normal"),
+        is_read=item.get("isRead", False),
+        has_attachments=item.get("hasAttachments", False),
+        received_date_time=datetime.fromisoformat(received.replace('Z', '+00:00')) if received else None,
+        sender=sender
+    )
+
+def email_body_text(message: dict):
+    """A Graph message's own body text, cleaned and fitted to EMAIL_CONTENT_MAX_TOKENS"""
+    body = message.get("body") or {}
+    return prepare_email_content(body.get("content", ""), EMAIL_CONTENT_MAX_TOKENS, body.get("contentType", "html"))
+
+def follow_up_flag(reminder_date):
+    """Message PATCH body that flags a message for follow-up at reminder_date"""
+    return {
+        "flag": {
+            "flagStatus": "flagged",
+            "startDateTime": {
+                "dateTime": reminder_date.isoformat(),
+                "timeZone": "UTC"
+            },
+            "dueDateTime": {
+                "dateTime": reminder_date.isoformat(),
+                "timeZone": "UTC"
+            }
+        }
+    }
+
+def filter_personal_folders(folders: list, default_folder_ids=()):
+    """Leave out the default folders, matched by id and, for English mailboxes, by display name"""
     personal_folders = []
     for folder in folders:
-        if folder["displayName"] not in default_mail_boxes:
+        if folder["id"] not in default_folder_ids and folder["displayName"] not in default_mail_boxes:
             personal_folders.append(folder)
     return personal_folders
 
@@ -31,36 +102,99 @@ class EmailService:
         self.auth = graph_auth
 
     async def get_emails(self, folder="inbox", max_count=None):
-        """Get emails from a specific folder"""
+        """Get emails from a specific folder, following every page unless max_count is set"""
+        return [email async for email in self.iter_emails(folder, max_count=max_count)]
+
+    async def iter_emails(self, folder="inbox", page_size=EMAIL_PAGE_SIZE, max_count=None):
+        """Yield emails from a folder, fetching the next page only when it is needed"""
         params = {
             "$orderby": "receivedDateTime DESC",
-            "$select": "id,subject,bodyPreview,from,toRecipients,ccRecipients,receivedDateTime,importance,isRead,hasAttachments"
+            "$select": EMAIL_SELECT_FIELDS,
+            "$top": min(page_size, max_count) if max_count else page_size
         }
-        if max_count:
-            params["$top"] = max_count
-        
+
         endpoint = f"me/mailFolders/{folder}/messages"
-        response = await self.auth.make_request("GET", endpoint, params=params)
-        
-        if response and "value" in response:
-            emails = []
-            for item in response["value"]:
-                sender = item["from"]["emailAddress"]["address"] if "from" in item and "emailAddress" in item["from"] else None
-                
-                email = EmailMessage(
-                    id=item["id"],
-                    subject=item["subject"],
-                    body=item["bodyPreview"],
-                    to_recipients=[r["emailAddress"]["address"] for r in item["toRecipients"]],
-                    importance=item["importance"],
-                    is_read=item["isRead"],
-                    has_attachments=item["hasAttachments"],
-                    received_date_time=datetime.fromisoformat(item["receivedDateTime"].replace('Z', '+00:00')),
-                    sender=sender
-                )
-                emails.append(email)
-            return emails
-        return []
+        count = 0
+        while endpoint:
+            response = await self.auth.make_request("GET", endpoint, params=params) or {}
+            for item in response.get("value", []):
+                yield parse_email(item)
+                count += 1
+                if max_count and count >= max_count:
+                    return
+            # nextLink already carries $top/$skip and the original query
+            endpoint = response.get("@odata.nextLink")
+            params = None
+
+    async def get_email_changes(self, folder="inbox", delta_link=None):
+        """Get new or changed emails in a folder since the last delta sync.
+
+        Returns the changed emails and the delta link to pass on the next call.
+        """
+        if delta_link:
+            endpoint = delta_link
+            params = None
+        else:
+            endpoint = f"me/mailFolders/{folder}/messages/delta"
+            since = datetime.now(timezone.utc) - timedelta(days=EMAIL_DELTA_INITIAL_DAYS)
+            params = {
+                "$select": EMAIL_SELECT_FIELDS,
+                "$filter": f"receivedDateTime ge {since.strftime('%Y-%m-%dT%H:%M:%SZ')}"
+            }
+        headers = {"Prefer": f"odata.maxpagesize={EMAIL_DELTA_PAGE_SIZE}"}
+
+        emails = []
+        while True:
+            response = await self.auth.make_request("GET", endpoint, params=params, headers=headers) or {}
+            for item in response.get("value", []):
+                # Deleted or moved-out messages only carry their id
+                if "@removed" in item:
+                    continue
+                emails.append(parse_email(item))
+            if "@odata.nextLink" in response:
+                endpoint = response["@odata.nextLink"]
+                params = None
+                continue
+            return emails, response.get("@odata.deltaLink")
+
+    async def list_folders(self, params=None):
+        """Get every top-level mail folder, following @odata.nextLink across pages"""
+        params = {"$top": 100, **(params or {})}
+        endpoint = "me/mailFolders"
+        folders = []
+        while endpoint:
+            response = await self.auth.make_request("GET", endpoint, params=params) or {}
+            folders.extend(response.get("value", []))
+            # nextLink already carries $top/$skip and the original query
+            endpoint = response.get("@odata.nextLink")
+            params = None
+        return folders
+
+    async def get_folder_counts(self):
+        """Get total and unread item counts for every top-level mail folder.
+
+        Child folders are not included; use get_folder_count for one of those.
+        """
+        key = (self.auth.email, None)
+        counts = folder_counts_cache.get(key)
+        if counts is not None:
+            return counts
+        counts = await self.list_folders({"$select": "id,displayName,totalItemCount,unreadItemCount"})
+        folder_counts_cache.set(key, counts)
+        return counts
+
+    async def get_folder_count(self, folder="inbox"):
+        """Get the item counts of one folder from its metadata instead of listing messages"""
+        key = (self.auth.email, folder)
+        counts = folder_counts_cache.get(key)
+        if counts is not None:
+            return counts
+        params = {
+            "$select": "id,displayName,totalItemCount,unreadItemCount"
+        }
+        counts = await self.auth.make_request("GET", f"me/mailFolders/{folder}", params=params) or {}
+        folder_counts_cache.set(key, counts)
+        return counts
 
     async def get_email_content(self, email_id):
         """Get full content of a specific email"""
@@ -77,20 +211,70 @@ class EmailService:
     # In app/services/email_service.py
     async def get_folders(self):
         """Get all mail folders"""
+        key = (self.auth.email, "folders")
+        cached = folder_cache.get(key)
+        if cached is not None:
+            return cached[0]
         try:
-            endpoint = f"me/mailFolders"
-            params = {
-                "$top": 100
+            folders = await self.list_folders()
+            index = {
+                "by_id": {folder["id"]: folder for folder in folders},
+                "by_name": {folder["displayName"].lower(): folder for folder in folders}
             }
-            response = await self.auth.make_request("GET", endpoint, params=params)
-            
-            if response and "value" in response:
-                return response.get("value", [])
-            return []
+            folder_cache.set(key, (folders, index))
+            return folders
         except Exception as e:
             print(f"Error in get_folders: {str(e)}")
             return []
 
+    async def get_folder_index(self):
+        """Get the mail folders indexed by id ("by_id") and lower-cased display name ("by_name")"""
+        await self.get_folders()
+        cached = folder_cache.get((self.auth.email, "folders"))
+        return cached[1] if cached else {"by_id": {}, "by_name": {}}
+
+    async def get_well_known_folder(self, name="inbox"):
+        """Resolve a folder by its Graph well-known name (inbox, drafts, sentitems, ...).
+
+        Unlike matching on displayName this works for localized mailboxes.
+        """
+        key = (self.auth.email, "well_known", name)
+        folder = folder_cache.get(key)
+        if folder is not None:
+            return folder
+        folder = await self.auth.make_request("GET", f"me/mailFolders/{name}")
+        if folder:
+            # Well-known folder ids never change, so keep them for the cache's lifetime
+            folder_cache.set(key, folder, ttl=0)
+        return folder
+
+    async def get_default_folder_ids(self):
+        """Ids of the WELL_KNOWN_FOLDERS, resolved in one $batch so localized names don't matter"""
+        key = (self.auth.email, "default_folder_ids")
+        folder_ids = folder_cache.get(key)
+        if folder_ids is not None:
+            return folder_ids
+        requests = [{"method": "GET", "url": f"me/mailFolders/{name}?$select=id"} for name in WELL_KNOWN_FOLDERS]
+        results = await self.auth.batch(requests)
+        folder_ids = set()
+        complete = True
+        for name, result in zip(WELL_KNOWN_FOLDERS, results):
+            if isinstance(result, GraphAPIError) and result.status_code == 404:
+                # Not every mailbox has every default folder (e.g. Archive)
+                continue
+            if isinstance(result, Exception) or not result:
+                print(f"Error resolving folder {name}: {result}")
+                complete = False
+                continue
+            folder_ids.add(result["id"])
+        if complete:
+            # Like well-known folders, these ids never change
+            folder_cache.set(key, folder_ids, ttl=0)
+        return folder_ids
+
+    def invalidate_folders(self):
+        folder_cache.pop((self.auth.email, "folders"))
+        folder_counts_cache.pop((self.auth.email, None))
 
     async def create_folder(self, display_name):
         """Create a new mail folder"""
@@ -99,30 +283,86 @@ class EmailService:
             "displayName": display_name
         }
         response = await self.auth.make_request("POST", endpoint, data=data)
+        self.invalidate_folders()
         return response
 
     async def sort_emails(self, folders, emails):
         """Sort emails based on existing folders"""
         results = []
-        personal_folders = filter_personal_folders(folders)
+        personal_folders = filter_personal_folders(folders, await self.get_default_folder_ids())
         if not personal_folders:
             return []
 
+        # A compact id/name index of the candidate folders instead of the raw Graph objects
+        folder_index = [{"id": folder["id"], "name": folder["displayName"]} for folder in personal_folders]
+        # User rules and the learned model first; only the rest goes to the LLM
+        local_targets = await classifier_service.classify(self.auth.email, emails, folder_index, await self.get_folder_index())
+        remaining = [email for email in emails if email.id not in local_targets]
+        targets = dict(local_targets)
+        if SORT_BATCH_SIZE > 1:
+            for i in range(0, len(remaining), SORT_BATCH_SIZE):
+                targets.update(await self.classify_emails(folder_index, remaining[i:i + SORT_BATCH_SIZE]))
+
+        moves = []
         for email in emails:
-            prompt = openai_service.generate_sort_mail_prompt(folders, email.subject, str(email.body))
-            messages = [{'role': 'user', 'content': prompt}]
-            target_folder = await openai_service.get_openai_response(messages)
-            target_folder = target_folder.replace('```', '').replace('"', '').replace("'", '')
+            target_folder = targets.get(email.id)
+            if not target_folder:
+                # Batch answer missing or unusable for this email: ask for it alone
+                prompt = openai_service.generate_sort_mail_prompt(folder_index, email.subject, str(email.body))
+                messages = [{'role': 'user', 'content': prompt}]
+                target_folder = await openai_service.get_openai_response(messages, cache=False, priority=BACKGROUND)
+                target_folder = target_folder.replace('```', '').replace('"', '').replace("'", '').strip()
+            moves.append((email, target_folder))
+
+        moved = await self.move_emails([(email.id, target_folder) for email, target_folder in moves])
+        learned = []
+        for (email, target_folder), result in zip(moves, moved):
             email_id = email.id
-            await self.move_email(email_id, target_folder)
-            supabase_service.log_activity(self.auth.email, 'sort_email', f"Sorted mail {email_id} to {target_folder}")
+            if isinstance(result, Exception):
+                print(f"Error sorting mail {email_id}: {result}")
+                continue
+            activity_logger.log(self.auth.email, 'sort_email', f"Sorted mail {email_id} to {target_folder}")
             results.append({
                 "id": email_id,
                 "subject": email.subject,
                 "target_folder": target_folder
             })
+            if email_id not in local_targets:
+                learned.append((email, target_folder))
+
+        try:
+            await classifier_service.learn(self.auth.email, learned)
+        except Exception as e:
+            print(f"Error training sort classifier: {e}")
         return results
 
+    async def classify_emails(self, folder_index, emails):
+        """Pick a target folder for several emails in one LLM request.
+
+        Returns a dict of email id to folder id, leaving out any email whose
+        answer is missing or not one of the indexed folders.
+        """
+        items = [
+            {"n": str(n), "subject": email.subject, "content": str(email.body)}
+            for n, email in enumerate(emails, start=1)
+        ]
+        prompt = openai_service.generate_batch_sort_mail_prompt(folder_index, items)
+        messages = [{'role': 'user', 'content': prompt}]
+        try:
+            response = await openai_service.get_openai_response(messages, cache=False, priority=BACKGROUND)
+            answer = json.loads(response[response.index('{'):response.rindex('}') + 1])
+        except Exception as e:
+            print(f"Error classifying emails in batch: {e}")
+            return {}
+
+        folder_ids = {folder["id"] for folder in folder_index}
+        targets = {}
+        for n, email in enumerate(emails, start=1):
+            target_folder = answer.get(str(n))
+            if target_folder in folder_ids:
+                targets[email.id] = target_folder
+        return targets
+
     async def move_email(self, email_id, target_folder):
         """Move an email to a specific folder"""
         endpoint = f"me/messages/{email_id}/move"
@@ -131,14 +371,31 @@ class EmailService:
         }
         return await self.auth.make_request("POST", endpoint, data=data)
 
+    async def move_emails(self, moves):
+        """Move several emails in batched requests; moves is a list of (email_id, target_folder)"""
+        requests = [
+            {
+                "method": "POST",
+                "url": f"me/messages/{email_id}/move",
+                "body": {"destinationId": target_folder}
+            }
+            for email_id, target_folder in moves
+        ]
+        return await self.auth.batch(requests)
+
+    async def delete_emails(self, email_ids):
+        """Delete several emails in batched requests; returns one result or Exception per id"""
+        requests = [{"method": "DELETE", "url": f"me/messages/{email_id}"} for email_id in email_ids]
+        return await self.auth.batch(requests)
+
     async def send_reply(self, email_id, template, send_without_approval=False):
         """Send a reply to an email"""
         # First, get the email to reply to
         email = await self.get_email_content(email_id)
         subject = email.get("subject", "")
-        prompt = openai_service.generate_reply_prompt(template, subject, email.get("body", {}).get("content", ""))
+        prompt = openai_service.generate_reply_prompt(template, subject, email_body_text(email))
         messages = [{'role': 'user', 'content': prompt}]
-        response = await openai_service.get_openai_response(messages)
+        response = await openai_service.get_openai_response(messages, priority=BACKGROUND)
         
         # Create reply
         if send_without_approval:
@@ -147,7 +404,7 @@ class EmailService:
             data = {
                 "comment": response
             }
-            supabase_service.log_activity(self.auth.email, 'send_reply', f"Replied to mail {email_id}")
+            activity_logger.log(self.auth.email, 'send_reply', f"Replied to mail {email_id}")
             return await self.auth.make_request("POST", endpoint, data=data)
         else:
             # Create a draft reply
@@ -166,7 +423,7 @@ class EmailService:
                     }
                 ]
             }
-            supabase_service.log_activity(self.auth.email, 'send_reply', f"Replied to mail {email_id}")
+            activity_logger.log(self.auth.email, 'send_reply', f"Replied to mail {email_id}")
             return await self.auth.make_request("POST", endpoint, data=data)
 
     async def send_manual_reply(self, email_id, body, send_without_approval=False):
@@ -182,7 +439,7 @@ class EmailService:
             data = {
                 "comment": body
             }
-            supabase_service.log_activity(self.auth.email, 'send_reply_manual', f"Replied to mail {email_id}")
+            activity_logger.log(self.auth.email, 'send_reply_manual', f"Replied to mail {email_id}")
             return await self.auth.make_request("POST", endpoint, data=data)
         else:
             # Create a draft reply
@@ -201,7 +458,7 @@ class EmailService:
                     }
                 ]
             }
-            supabase_service.log_activity(self.auth.email, 'send_reply_manual', f"Replied to mail {email_id}")
+            activity_logger.log(self.auth.email, 'send_reply_manual', f"Replied to mail {email_id}")
             return await self.auth.make_request("POST", endpoint, data=data)
 
     async def generate_ai_reply(self, email_id: str):
@@ -210,7 +467,7 @@ class EmailService:
         user = await self.auth.make_request("GET", "me")
         prompt = openai_service.generate_ai_reply(
             email.get("subject", ""),
-            email.get("body", {}).get("content", ""),
+            email_body_text(email),
             user
         )
         messages = [{'role': 'user', 'content': prompt}]
@@ -220,24 +477,30 @@ class EmailService:
     async def set_follow_up(self, email_id, reminder_date, note=None):
         """Set a follow-up flag for an email"""
         endpoint = f"me/messages/{email_id}"
+        data = follow_up_flag(reminder_date)
 
-        data = {
-            "flag": {
-                "flagStatus": "flagged",
-                "startDateTime": {
-                    "dateTime": reminder_date.isoformat(),
-                    "timeZone": "UTC"
-                },
-                "dueDateTime": {
-                    "dateTime": reminder_date.isoformat(),
-                    "timeZone": "UTC"
-                }
-            }
-        }
-
-        supabase_service.log_activity(self.auth.email, 'set_follow_up', f"Follow up mail {email_id}")
+        activity_logger.log(self.auth.email, 'set_follow_up', f"Follow up mail {email_id}")
         return await self.auth.make_request("PATCH", endpoint, data=data)
 
+    async def set_follow_ups(self, email_ids, reminder_date):
+        """Set the same follow-up flag on several emails in batched requests.
+
+        Returns one result per email id: the updated message or an Exception.
+        """
+        requests = [
+            {
+                "method": "PATCH",
+                "url": f"me/messages/{email_id}",
+                "body": follow_up_flag(reminder_date)
+            }
+            for email_id in email_ids
+        ]
+        results = await self.auth.batch(requests)
+        for email_id, result in zip(email_ids, results):
+            if not isinstance(result, Exception):
+                activity_logger.log(self.auth.email, 'set_follow_up', f"Follow up mail {email_id}")
+        return results
+
 
     def get_templates(self):
         """Get email templates from the template file"""
@@ -0,0 +1,29 @@
+from config import LEDGER_CACHE_SIZE
+from app.services.supabase_service import async_supabase_service
+from app.utils.cache import TTLCache
+
+class MessageLedger:
+    """Idempotency ledger of the processor actions already applied to a message.
+
+    The durable record lives in the `processed_messages` table; an in-memory
+    LRU in front of it answers most lookups without a database round trip.
+    """
+
+    def __init__(self) -> None:
+        self._seen = TTLCache(maxsize=LEDGER_CACHE_SIZE)
+
+    async def filter_unprocessed(self, email: str, message_ids: list, action: str):
+        """Return the message ids that have not had `action` applied yet"""
+        pending = [m for m in message_ids if not self._seen.get((email, m, action))]
+        if not pending:
+            return []
+        done = await async_supabase_service.get_processed_messages(email, pending, action)
+        for message_id in done:
+            self._seen.set((email, message_id, action), True)
+        return [m for m in pending if m not in done]
+
+    async def mark_processed(self, email: str, message_id: str, action: str):
+        await async_supabase_service.mark_message_processed(email, message_id, action)
+        self._seen.set((email, message_id, action), True)
+
+message_ledger = MessageLedger()
@@ -0,0 +1,172 @@
+import asyncio
+import heapq
+import itertools
+import random
+import time
+from collections import Counter, deque
+from contextlib import asynccontextmanager
+import openai
+from config import (
+    LLM_MAX_CONCURRENCY,
+    LLM_MAX_RETRIES,
+    LLM_RPM_LIMIT,
+    LLM_TPM_LIMIT,
+)
+from app.utils.content import count_tokens
+
+# Lower values are served first
+INTERACTIVE = 0
+BACKGROUND = 1
+
+PRIORITY_NAMES = {INTERACTIVE: "interactive", BACKGROUND: "background"}
+
+def estimate_tokens(messages):
+    """Prompt size in tokens, counting the message contents"""
+    if isinstance(messages, str):
+        return count_tokens(messages)
+    return sum(count_tokens(str(message.get("content", ""))) + 4 for message in messages)
+
+class LLMDispatcher:
+    """Central scheduler for OpenAI requests.
+
+    Requests wait in a priority queue, so interactive calls (chat, AI reply,
+    analysis) always go ahead of the background processor's replies and
+    sorting. A request starts only when fewer than LLM_MAX_CONCURRENCY are in
+    flight and the last minute's requests and tokens leave room under
+    LLM_RPM_LIMIT and LLM_TPM_LIMIT (0 disables a budget). Rate-limit errors
+    are retried up to LLM_MAX_RETRIES times with exponential backoff and
+    jitter.
+    """
+
+    def __init__(self) -> None:
+        self.active = 0
+        self.counters = Counter()
+        self.wait_total = Counter()
+        self.wait_max = Counter()
+        self._queue = []
+        self._window = deque()
+        self._seq = itertools.count()
+        self._condition = None
+        self._loop = None
+
+    def _get_condition(self):
+        loop = asyncio.get_running_loop()
+        if self._condition is None or self._loop is not loop:
+            self._condition = asyncio.Condition()
+            self._loop = loop
+        return self._condition
+
+    def _prune(self, now: float):
+        while self._window and self._window[0][0] <= now - 60:
+            self._window.popleft()
+
+    def _budget_wait(self, now: float, tokens: int):
+        """Seconds until the request fits the per-minute budgets, 0 if it fits now"""
+        if not self._window:
+            return 0
+        if LLM_RPM_LIMIT and len(self._window) >= LLM_RPM_LIMIT:
+            return self._window[0][0] + 60 - now
+        if LLM_TPM_LIMIT and sum(entry[1] for entry in self._window) + tokens > LLM_TPM_LIMIT:
+            return self._window[0][0] + 60 - now
+        return 0
+
+    async def acquire(self, priority: int = INTERACTIVE, tokens: int = 0):
+        """Wait for a slot and return its budget entry, to be passed to release()"""
+        condition = self._get_condition()
+        entry = (priority, next(self._seq))
+        started = time.monotonic()
+        async with condition:
+            heapq.heappush(self._queue, entry)
+            try:
+                while True:
+                    now = time.monotonic()
+                    self._prune(now)
+                    wait = None
+                    if self._queue[0] == entry and self.active < LLM_MAX_CONCURRENCY:
+                        wait = self._budget_wait(now, tokens)
+                        if wait <= 0:
+                            heapq.heappop(self._queue)
+                            self.active += 1
+                            budget = [now, tokens]
+                            self._window.append(budget)
+                            self._record_wait(priority, now - started)
+                            # The next request in line may be able to start too
+                            condition.notify_all()
+                            return budget
+                    try:
+                        await asyncio.wait_for(condition.wait(), timeout=wait)
+                    except asyncio.TimeoutError:
+                        pass
+            except BaseException:
+                if entry in self._queue:
+                    self._queue.remove(entry)
+                    heapq.heapify(self._queue)
+                    condition.notify_all()
+                raise
+
+    async def release(self, budget: list, tokens: int = None):
+        """Free the slot, charging the actual token usage when it is known"""
+        if tokens is not None:
+            budget[1] = tokens
+        condition = self._get_condition()
+        async with condition:
+            self.active -= 1
+            condition.notify_all()
+
+    def _record_wait(self, priority: int, wait: float):
+        name = PRIORITY_NAMES.get(priority, str(priority))
+        self.counters[f"{name}_requests"] += 1
+        self.wait_total[name] += wait
+        self.wait_max[name] = max(self.wait_max[name], wait)
+
+    @asynccontextmanager
+    async def slot(self, priority: int = INTERACTIVE, tokens: int = 0):
+        """Hold a slot for the duration of the block, e.g. while a response streams"""
+        budget = await self.acquire(priority, tokens)
+        try:
+            yield budget
+        finally:
+            await self.release(budget)
+
+    async def run(self, call, priority: int = INTERACTIVE, tokens: int = 0):
+        """Run `await call()` in a slot, retrying when OpenAI rate-limits the request"""
+        for attempt in range(LLM_MAX_RETRIES + 1):
+            budget = await self.acquire(priority, tokens)
+            usage = None
+            try:
+                res = await call()
+                usage = res.usage.total_tokens if getattr(res, "usage", None) else None
+                return res
+            except openai.RateLimitError:
+                self.counters["rate_limited"] += 1
+                if attempt == LLM_MAX_RETRIES:
+                    raise
+            finally:
+                await self.release(budget, usage)
+            self.counters["retries"] += 1
+            await asyncio.sleep(min(30.0, 2 ** attempt) * (0.5 + random.random() / 2))
+
+    def stats(self):
+        depth = Counter(PRIORITY_NAMES.get(entry[0], str(entry[0])) for entry in self._queue)
+        waits = {}
+        for name in PRIORITY_NAMES.values():
+            count = self.counters[f"{name}_requests"]
+            waits[name] = {
+                "queued": depth.get(name, 0),
+                "requests": count,
+                "avg_wait": round(self.wait_total[name] / count, 4) if count else 0.0,
+                "max_wait": round(self.wait_max[name], 4)
+            }
+        now = time.monotonic()
+        self._prune(now)
+        return {
+            "in_flight": self.active,
+            "queue_depth": len(self._queue),
+            "requests_last_minute": len(self._window),
+            "tokens_last_minute": sum(entry[1] for entry in self._window),
+            "rate_limited": self.counters["rate_limited"],
+            "retries": self.counters["retries"],
+            **waits
+        }
+
+llm_dispatcher = LLMDispatcher()
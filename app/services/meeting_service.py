@@ -1,7 +1,7 @@
 import datetime
 from app.auth.graph_auth import GraphAuth
 from app.models.schema import MeetingDetails, MeetingNotes
-from app.services.supabase_service import supabase_service
+from app.services.activity_logger import activity_logger
 
 class MeetingService:
     def __init__(self, graph_auth: GraphAuth):
@@ -50,7 +50,7 @@ class MeetingService:
         return meetings
 
     def join_meeting(self, meeting_url):
-        supabase_service.log_activity(self.auth.email, "join_meeting", f"Joined a meeting: {meeting_url}")
+        activity_logger.log(self.auth.email, "join_meeting", f"Joined a meeting: {meeting_url}")
         return {
             "status": "ready_to_join",
             "meeting_url": meeting_url,
@@ -1,5 +1,16 @@
+import asyncio
+import json
 from openai import AsyncOpenAI
-from config import OPENAI_API_KEY
+from config import (
+    DOCUMENT_MAX_TOKENS,
+    OPENAI_API_KEY,
+    SUMMARY_CACHE_TTL,
+    SUMMARY_CHUNK_TOKENS,
+    SUMMARY_MAX_PARALLEL,
+)
+from app.services.llm_dispatcher import INTERACTIVE, estimate_tokens, llm_dispatcher
+from app.services.response_cache import prompt_key, response_cache
+from app.utils.content import count_tokens, fit_to_budget, split_text
 
 openai_client = AsyncOpenAI(api_key=OPENAI_API_KEY)
 
@@ -7,8 +18,25 @@ class OpenAIService:
     def __init__(self) -> None:
         pass
 
-    async def get_openai_response(self, messages, model='gpt-3.5-turbo'):
-        res = await openai_client.responses.create(input=messages, model=model)
+    async def get_openai_response(self, messages, model='gpt-3.5-turbo', cache: bool = True, cache_ttl: float = None, priority: int = INTERACTIVE):
+        """Return the model's text output, reusing a cached response for an identical prompt
+        cache: False for conversational calls whose answer should not be reused
+        cache_ttl: seconds to keep the response, overriding LLM_CACHE_TTL (0 keeps it until evicted)
+        priority: INTERACTIVE for user-facing requests, BACKGROUND for the email processor
+        """
+        key = prompt_key(model, messages) if cache else None
+        if key:
+            cached = await response_cache.get(key)
+            if cached is not None:
+                return cached
+        res = await llm_dispatcher.run(
+            lambda: openai_client.responses.create(input=messages, model=model),
+            priority=priority,
+            tokens=estimate_tokens(messages)
+        )
+        if key:
+            tokens = res.usage.total_tokens if res.usage else 0
+            await response_cache.set(key, res.output_text, tokens, ttl=cache_ttl)
         return res.output_text
     
     async def analyze_email(self, email_content):
@@ -29,8 +57,47 @@ class OpenAIService:
         response = await self.get_openai_response(messages)
         return response
 
+    async def summarize_chunks(self, text, instruction, max_tokens=DOCUMENT_MAX_TOKENS):
+        """Reduce text to at most max_tokens tokens by map-reduce summarization.
+
+        Text that already fits is returned as is. Otherwise it is split into
+        chunks that are summarized concurrently (at most SUMMARY_MAX_PARALLEL
+        at a time), and the joined summaries are summarized again in groups
+        until they fit. Every summary is cached by the hash of its input, so
+        re-summarizing an edited document only costs its changed chunks.
+        instruction: what each partial summary should keep
+        """
+        semaphore = asyncio.Semaphore(SUMMARY_MAX_PARALLEL)
+
+        async def summarize(chunk):
+            prompt = f"""
+        The following is one part of a longer text. {instruction}
+        Be concise and don't include your any explanation.
+
+        Text:
+        ```
+        {chunk}
+        ```"""
+            messages = [{'role': 'user', 'content': prompt}]
+            async with semaphore:
+                return await self.get_openai_response(messages, cache_ttl=SUMMARY_CACHE_TTL)
+
+        while count_tokens(text) > max_tokens:
+            chunks = split_text(text, SUMMARY_CHUNK_TOKENS)
+            summaries = await asyncio.gather(*(summarize(chunk) for chunk in chunks))
+            reduced = "\n\n".join(summaries)
+            if count_tokens(reduced) >= count_tokens(text):
+                # The summaries are not getting shorter; stop rather than loop
+                return fit_to_budget(reduced, max_tokens)
+            text = reduced
+        return text
+
     async def process_meeting_notes(self, transcript):
         """Process meeting transcript and generate structured notes"""
+        transcript = await self.summarize_chunks(
+            transcript,
+            "Summarize the key points discussed and list every action item and decision with the persons assigned, if mentioned."
+        )
         prompt = f"""
         Please analyze the following meeting transcript and:
         1. Provide a concise summary of the key points discussed
@@ -49,9 +116,8 @@ class OpenAIService:
     
     async def summarize_document(self, text):
         """Summarize document content"""
-        # If text is too long, truncate it to fit within token limits
-        if len(text) > 8000:
-            text = text[:8000] + "..."
+        # If text is too long, summarize it in parts to fit within token limits
+        text = await self.summarize_chunks(text, "Summarize its key points, keeping names, figures and dates.")
             
         prompt = f"""
         Please provide a concise summary of the following document:
@@ -65,10 +131,8 @@ class OpenAIService:
         response = await self.get_openai_response(messages)
         return response
 
-    # Add to app/services/ai_service.py
-    async def process_chat_message(self, message):
-        """Process a chat message and generate a response"""
-        prompt = f"""
+    def generate_chat_prompt(self, message):
+        return f"""
         You are an Email AI Assistant for Elysia Partners. Respond to the following query 
         in a helpful, professional manner. If the query is about email management, 
         sorting, or scheduling, provide specific guidance.
@@ -77,11 +141,23 @@ class OpenAIService:
         
         Your response:
         """
-        
-        messages = [{'role': 'user', 'content': prompt}]
-        response = await self.get_openai_response(messages)
+
+    # Add to app/services/ai_service.py
+    async def process_chat_message(self, message):
+        """Process a chat message and generate a response"""
+        messages = [{'role': 'user', 'content': self.generate_chat_prompt(message)}]
+        response = await self.get_openai_response(messages, cache=False)
         return response
 
+    async def stream_chat_message(self, message, model='gpt-3.5-turbo'):
+        """Process a chat message and yield the response text as it is generated"""
+        messages = [{'role': 'user', 'content': self.generate_chat_prompt(message)}]
+        async with llm_dispatcher.slot(INTERACTIVE, estimate_tokens(messages)):
+            stream = await openai_client.responses.create(input=messages, model=model, stream=True)
+            async for event in stream:
+                if event.type == "response.output_text.delta":
+                    yield event.delta
+
     def generate_reply_prompt(self, template, email_subject: str, email_content: str):
         return f"""
         You need to customize the following email template to create a personalized reply
@@ -145,4 +221,22 @@ class OpenAIService:
         
         Return only target folder's id. Don't include your any explanation."""
 
+    def generate_batch_sort_mail_prompt(self, folders: list, emails: list):
+        return f"""
+        You need to select a target folder for each email below.
+        Select each target folder only in these folders, by id.
+
+        Folders:
+        ```
+        {json.dumps(folders, ensure_ascii=False)}
+        ```
+
+        Emails (each has a number "n"):
+        ```
+        {json.dumps(emails, ensure_ascii=False)}
+        ```
+
+        Return only a JSON object that maps each email's "n" to its target folder's id,
+        for example {{"1": "<folder id>", "2": "<folder id>"}}. Don't include your any explanation."""
+
 openai_service = OpenAIService()
@@ -0,0 +1,110 @@
+import asyncio
+import hashlib
+import json
+import sqlite3
+import threading
+import time
+from collections import Counter
+from config import LLM_CACHE_PATH, LLM_CACHE_SIZE, LLM_CACHE_TTL
+from app.utils.cache import TTLCache
+
+def normalize_messages(messages):
+    """Messages with collapsed whitespace, so re-indented prompts hash the same"""
+    if isinstance(messages, str):
+        return " ".join(messages.split())
+    normalized = []
+    for message in messages:
+        content = message.get("content")
+        if isinstance(content, str):
+            content = " ".join(content.split())
+        normalized.append({**message, "content": content})
+    return normalized
+
+def prompt_key(model: str, messages):
+    payload = json.dumps([model, normalize_messages(messages)], sort_keys=True, ensure_ascii=False)
+    return hashlib.sha256(payload.encode()).hexdigest()
+
+class ResponseCache:
+    """Content-addressed cache of LLM responses keyed by model and prompt hash.
+
+    Entries live in an in-memory LRU and, if LLM_CACHE_PATH is set, in a
+    sqlite file shared across restarts and processes. Each entry remembers
+    the tokens its completion cost so hits can be reported as tokens saved.
+    """
+
+    def __init__(self) -> None:
+        self.memory = TTLCache(maxsize=LLM_CACHE_SIZE, ttl=LLM_CACHE_TTL)
+        self.counters = Counter()
+        self._db = None
+        self._db_lock = threading.Lock()
+
+    def _connect(self):
+        if self._db is None:
+            self._db = sqlite3.connect(LLM_CACHE_PATH, check_same_thread=False)
+            self._db.execute(
+                "CREATE TABLE IF NOT EXISTS llm_cache "
+                "(key TEXT PRIMARY KEY, value TEXT NOT NULL, tokens INTEGER NOT NULL, expires_at REAL)"
+            )
+            self._db.commit()
+        return self._db
+
+    def _disk_get(self, key: str):
+        with self._db_lock:
+            row = self._connect().execute(
+                "SELECT value, tokens, expires_at FROM llm_cache WHERE key = ?", (key,)
+            ).fetchone()
+        if row is None or (row[2] is not None and row[2] <= time.time()):
+            return None
+        return row
+
+    def _disk_set(self, key: str, value: str, tokens: int, ttl: float):
+        expires_at = time.time() + ttl if ttl else None
+        with self._db_lock:
+            db = self._connect()
+            db.execute(
+                "INSERT OR REPLACE INTO llm_cache (key, value, tokens, expires_at) VALUES (?, ?, ?, ?)",
+                (key, value, tokens, expires_at)
+            )
+            db.execute("DELETE FROM llm_cache WHERE expires_at IS NOT NULL AND expires_at <= ?", (time.time(),))
+            db.commit()
+
+    async def get(self, key: str):
+        """Return the cached response text for key, or None"""
+        entry = self.memory.get(key)
+        if entry is None and LLM_CACHE_PATH:
+            try:
+                row = await asyncio.to_thread(self._disk_get, key)
+            except sqlite3.Error as e:
+                print(f"Error reading LLM cache: {e}")
+                row = None
+            if row is not None:
+                value, tokens, expires_at = row
+                entry = (value, tokens)
+                self.memory.set(key, entry, ttl=expires_at - time.time() if expires_at else 0)
+                self.counters["disk_hits"] += 1
+        if entry is None:
+            self.counters["misses"] += 1
+            return None
+        self.counters["hits"] += 1
+        self.counters["tokens_saved"] += entry[1]
+        return entry[0]
+
+    async def set(self, key: str, value: str, tokens: int = 0, ttl: float = None):
+        ttl = LLM_CACHE_TTL if ttl is None else ttl
+        self.memory.set(key, (value, tokens), ttl=ttl)
+        self.counters["tokens_spent"] += tokens
+        if LLM_CACHE_PATH:
+            try:
+                await asyncio.to_thread(self._disk_set, key, value, tokens, ttl)
+            except sqlite3.Error as e:
+                print(f"Error writing LLM cache: {e}")
+
+    def stats(self):
+        lookups = self.counters["hits"] + self.counters["misses"]
+        return {
+            **self.counters,
+            "size": self.memory.stats()["size"],
+            "hit_rate": round(self.counters["hits"] / lookups, 4) if lookups else 0.0
+        }
+
+response_cache = ResponseCache()
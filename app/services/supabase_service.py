@@ -1,16 +1,49 @@
+import asyncio
+import base64
+import functools
+import inspect
+import json
 from collections import Counter
-from datetime import datetime, timezone
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date, datetime, timedelta, timezone
 from fastapi import HTTPException
+from config import PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX, SETTINGS_CACHE_SIZE, SETTINGS_CACHE_TTL, SUPABASE_MAX_WORKERS
 from app.models.follow_up import FollowUpCreate
 from app.models.reply_template import ReplyTemplateCreate
+from app.models.schema import EmailRule
 from app.models.user import UserCreate
 from app.api.supabase import supabase
 from app.services.openai_service import openai_service
+from app.utils.cache import TTLCache
+
+def encode_cursor(row: dict):
+    raw = json.dumps([row['timestamp'], row['id']]).encode()
+    return base64.urlsafe_b64encode(raw).decode()
+
+def decode_cursor(cursor: str):
+    try:
+        timestamp, row_id = json.loads(base64.urlsafe_b64decode(cursor.encode()))
+        return str(timestamp), str(row_id)
+    except Exception:
+        raise HTTPException(detail="Invalid cursor", status_code=400)
+
+_MISSING = object()
 
 class SupabaseService:
     def __init__(self):
-        pass
+        # TTL+LRU cache of rarely-changing per-user rows: keys are
+        # ('user' | 'schedules' | 'templates' | 'rules', email). Write methods below
+        # invalidate the entries they touch.
+        self.cache = TTLCache(maxsize=SETTINGS_CACHE_SIZE, ttl=SETTINGS_CACHE_TTL)
+
+    def invalidate_settings(self, email: str, *kinds: str):
+        for kind in kinds or ('user', 'schedules', 'templates', 'rules'):
+            self.cache.pop((kind, email))
     
+    def _invalidate_rows(self, rows: list, kind: str):
+        for row in rows or []:
+            self.invalidate_settings(row['user_mail'], kind)
+
     def create_user(self, user: UserCreate):
         try:
             existing = supabase.table('users').select('*').eq('email', user.email).execute()
@@ -43,6 +76,7 @@ class SupabaseService:
                     'timestamp': 'now()'
                 }).execute()
 
+            self.invalidate_settings(user.email)
             return user_data.data[0]
         except HTTPException:
             raise
@@ -52,8 +86,13 @@ class SupabaseService:
     
     def get_user(self, email: str):
         try:
+            user = self.cache.get(('user', email), _MISSING)
+            if user is not _MISSING:
+                return user
             user_data = supabase.table('users').select('*').eq('email', email).execute()
-            return user_data.data[0] if user_data.data else None
+            user = user_data.data[0] if user_data.data else None
+            self.cache.set(('user', email), user)
+            return user
         except HTTPException:
             raise
         except Exception as e:
@@ -75,6 +114,7 @@ class SupabaseService:
             user_data = supabase.table('users').update({
                 'subscription': subscription
             }).eq('email', email).execute()
+            self.invalidate_settings(email, 'user')
             return user_data.data[0]
         except HTTPException:
             raise
@@ -87,6 +127,7 @@ class SupabaseService:
             user_data = supabase.table('users').update({
                 'access_token': access_token
             }).eq('email', email).execute()
+            self.invalidate_settings(email, 'user')
             return user_data.data[0]
         except HTTPException:
             raise
@@ -100,10 +141,17 @@ class SupabaseService:
             if not user:
                 raise HTTPException(detail="User not found", status_code=404)
             supabase.table('activity_logs').delete().eq('user_mail', email).execute()
+            supabase.table('activity_counters').delete().eq('user_mail', email).execute()
+            supabase.table('activity_totals').delete().eq('user_mail', email).execute()
             supabase.table('chat_history').delete().eq('user_mail', email).execute()
             supabase.table('reply_templates').delete().eq('user_mail', email).execute()
             supabase.table('schedules').delete().eq('user_mail', email).execute()
+            supabase.table('mail_sync_state').delete().eq('user_mail', email).execute()
+            supabase.table('processed_messages').delete().eq('user_mail', email).execute()
+            supabase.table('email_rules').delete().eq('user_mail', email).execute()
+            supabase.table('classifier_models').delete().eq('user_mail', email).execute()
             user_data = supabase.table('users').delete().eq('email', email).execute()
+            self.invalidate_settings(email)
             return user_data.data[0]
         except HTTPException:
             raise
@@ -116,6 +164,7 @@ class SupabaseService:
             user_data = supabase.table('users').update({
                 'automation': state
             }).eq('email', email).execute()
+            self.invalidate_settings(email, 'user')
             return user_data.data[0]
         except HTTPException:
             raise
@@ -123,29 +172,32 @@ class SupabaseService:
             print(f"Error toggle user automation: {e}")
             raise HTTPException(detail=str(e), status_code=500)
     
-    def log_activity(self, email: str, activity: str, details: str = ''):
-        """Log user activity
-        activity: "sort_email" | "send_reply" | "set_follow_up" | "process_file" | "join_meeting"
-        """
+    def log_activities(self, activities: list):
+        """Bulk insert activity log rows built by the activity logger"""
         try:
-            activity_data = supabase.table('activity_logs').insert({
-                'user_mail': email,
-                'activity': activity,
-                'details': details,
-                'timestamp': 'now()'
-            }).execute()
-            return activity_data.data[0]
+            activity_data = supabase.table('activity_logs').insert(activities).execute()
+            return activity_data.data
         except HTTPException:
             raise
         except Exception as e:
-            print(f"Error log activity: {e}")
+            print(f"Error log activities: {e}")
             raise HTTPException(detail=str(e), status_code=500)
-    
-    def get_activity_summary(self, email: str):
+
+    def get_activity_summary(self, email: str, since: date = None, until: date = None):
+        """Summarize activity from the rollup counters, optionally within [since, until]"""
         try:
-            summary_data = supabase.table('activity_logs').select('*').eq('user_mail', email).execute()
-            activities = summary_data.data
-            type_counts = Counter(a["activity"] for a in activities)
+            if since or until:
+                query = supabase.table('activity_counters').select('activity,count').eq('user_mail', email)
+                if since:
+                    query = query.gte('day', since.isoformat())
+                if until:
+                    query = query.lte('day', until.isoformat())
+            else:
+                query = supabase.table('activity_totals').select('activity,count').eq('user_mail', email)
+            counter_data = query.execute()
+            type_counts = Counter()
+            for row in counter_data.data:
+                type_counts[row["activity"]] += row["count"]
             summary = {
                 "emails_sorted": type_counts.get("sort_email", 0),
                 "replies_sent": type_counts.get("send_reply", 0),
@@ -163,13 +215,23 @@ class SupabaseService:
     async def get_openai_response(self, email: str, prompt: str):
         try:
             response = await openai_service.process_chat_message(prompt)
-            self.save_chat_history(email, "user", prompt)
-            self.save_chat_history(email, "ai", response)
+            await asyncio.to_thread(self.save_chat_history, email, "user", prompt)
+            await asyncio.to_thread(self.save_chat_history, email, "ai", response)
+            return response
         except HTTPException:
             raise
         except Exception as e:
             raise HTTPException(detail=str(e), status_code=500)
 
+    async def stream_openai_response(self, email: str, prompt: str):
+        """Yield the chat response as it is generated; the exchange is saved once it completes"""
+        chunks = []
+        async for delta in openai_service.stream_chat_message(prompt):
+            chunks.append(delta)
+            yield delta
+        await asyncio.to_thread(self.save_chat_history, email, "user", prompt)
+        await asyncio.to_thread(self.save_chat_history, email, "ai", "".join(chunks))
+
     def save_chat_history(self, email: str, sender: str, message: str):
         try:
             chat_data = supabase.table('chat_history').insert({
@@ -185,15 +247,42 @@ class SupabaseService:
             print(f"Error save chat history: {e}")
             raise HTTPException(detail=str(e), status_code=500)
     
-    def get_chat_history(self, email: str):
+    def get_chat_history(self, email: str, limit: int = None, cursor: str = None):
+        """Get one page of chat history in chronological order.
+
+        Pages walk backwards in time: pass the returned cursor to get the
+        previous (older) page.
+        """
         try:
-            chat_data = supabase.table('chat_history').select('*').eq('user_mail', email).execute()
-            return chat_data.data
+            messages, next_cursor = self._get_page('chat_history', email, limit, cursor)
+            return list(reversed(messages)), next_cursor
         except HTTPException:
             raise
         except Exception as e:
             print(f"Error get chat history: {e}")
             raise HTTPException(detail=str(e), status_code=500)
+
+    def get_activity_logs(self, email: str, limit: int = None, cursor: str = None):
+        """Get one page of activity logs, newest first"""
+        try:
+            return self._get_page('activity_logs', email, limit, cursor)
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error get activity logs: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def _get_page(self, table: str, email: str, limit: int = None, cursor: str = None):
+        """Keyset pagination over a user's rows ordered by (timestamp, id) descending"""
+        limit = max(1, min(limit or PAGE_SIZE_DEFAULT, PAGE_SIZE_MAX))
+        query = supabase.table(table).select('*').eq('user_mail', email)
+        if cursor:
+            timestamp, row_id = decode_cursor(cursor)
+            query = query.or_(f'timestamp.lt."{timestamp}",and(timestamp.eq."{timestamp}",id.lt."{row_id}")')
+        page_data = query.order('timestamp', desc=True).order('id', desc=True).limit(limit + 1).execute()
+        rows = page_data.data
+        next_cursor = encode_cursor(rows[limit - 1]) if len(rows) > limit else None
+        return rows[:limit], next_cursor
         
     def create_reply_template(self, template: ReplyTemplateCreate):
         try:
@@ -204,6 +293,7 @@ class SupabaseService:
                 'body': template.body,
                 'timestamp': 'now()'
             }).execute()
+            self._invalidate_rows(template_data.data, 'templates')
             return template_data.data[0]
         except HTTPException:
             raise
@@ -213,7 +303,11 @@ class SupabaseService:
 
     def get_reply_templates(self, email: str):
         try:
+            templates = self.cache.get(('templates', email))
+            if templates is not None:
+                return templates
             templates_data = supabase.table('reply_templates').select('*').eq('user_mail', email).execute()
+            self.cache.set(('templates', email), templates_data.data)
             return templates_data.data
         except HTTPException:
             raise
@@ -229,6 +323,7 @@ class SupabaseService:
                 'body': template.body,
                 'timestamp': 'now()'
             }).eq('id', template_id).execute()
+            self._invalidate_rows(template_data.data, 'templates')
             return template_data.data[0]
         except HTTPException:
             raise
@@ -239,6 +334,7 @@ class SupabaseService:
     def delete_reply_template(self, template_id: str):
         try:
             template_data = supabase.table('reply_templates').delete().eq('id', template_id).execute()
+            self._invalidate_rows(template_data.data, 'templates')
             return template_data.data[0]
         except HTTPException:
             raise
@@ -254,6 +350,7 @@ class SupabaseService:
                 'days': schedule.days,
                 'timestamp': 'now()'
             }).execute()
+            self._invalidate_rows(schedule_data.data, 'schedules')
             return schedule_data.data[0]
         except HTTPException:
             raise
@@ -263,7 +360,11 @@ class SupabaseService:
     
     def get_schedules(self, email: str):
         try:
+            schedules = self.cache.get(('schedules', email))
+            if schedules is not None:
+                return schedules
             schedules_data = supabase.table('schedules').select('*').eq('user_mail', email).execute()
+            self.cache.set(('schedules', email), schedules_data.data)
             return schedules_data.data
         except HTTPException:
             raise
@@ -278,6 +379,7 @@ class SupabaseService:
                 'days': schedule.days,
                 'timestamp': 'now()'
             }).eq('id', schedule_id).execute()
+            self._invalidate_rows(schedule_data.data, 'schedules')
             return schedule_data.data[0]
         except HTTPException:
             raise
@@ -288,6 +390,7 @@ class SupabaseService:
     def delete_schedule(self, id: str):
         try:
             schedule_data = supabase.table('schedules').delete().eq('id', id).execute()
+            self._invalidate_rows(schedule_data.data, 'schedules')
             return schedule_data.data[0]
         except HTTPException:
             raise
@@ -295,4 +398,181 @@ class SupabaseService:
             print(f"Error delete schedule: {e}")
             raise HTTPException(detail=str(e), status_code=500)
 
+    def create_email_rule(self, email: str, rule: EmailRule):
+        try:
+            rule_data = supabase.table('email_rules').insert({
+                'user_mail': email,
+                'field': rule.field,
+                'value': rule.value,
+                'target_folder': rule.target_folder,
+                'timestamp': 'now()'
+            }).execute()
+            self._invalidate_rows(rule_data.data, 'rules')
+            return rule_data.data[0]
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error create email rule: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def get_email_rules(self, email: str):
+        try:
+            rules = self.cache.get(('rules', email))
+            if rules is not None:
+                return rules
+            rules_data = supabase.table('email_rules').select('*').eq('user_mail', email).execute()
+            self.cache.set(('rules', email), rules_data.data)
+            return rules_data.data
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error get email rules: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def delete_email_rule(self, email: str, rule_id: str):
+        try:
+            rule_data = supabase.table('email_rules').delete().eq('id', rule_id).eq('user_mail', email).execute()
+            self.invalidate_settings(email, 'rules')
+            return rule_data.data[0]
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error delete email rule: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def get_classifier_model(self, email: str):
+        try:
+            model_data = supabase.table('classifier_models').select('model').eq('user_mail', email).execute()
+            return model_data.data[0]['model'] if model_data.data else None
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error get classifier model: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def merge_classifier_model(self, email: str, delta: dict, max_features: int):
+        """Add learned counts to the stored model in place (see merge_classifier_model in the migrations)"""
+        try:
+            supabase.rpc('merge_classifier_model', {
+                'p_user_mail': email,
+                'p_delta': delta,
+                'p_max_features': max_features
+            }).execute()
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error merge classifier model: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def get_delta_link(self, email: str, folder_id: str):
+        try:
+            state_data = supabase.table('mail_sync_state').select('delta_link').eq('user_mail', email).eq('folder_id', folder_id).execute()
+            return state_data.data[0]['delta_link'] if state_data.data else None
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error get delta link: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def save_delta_link(self, email: str, folder_id: str, delta_link: str):
+        try:
+            state_data = supabase.table('mail_sync_state').upsert({
+                'user_mail': email,
+                'folder_id': folder_id,
+                'delta_link': delta_link,
+                'timestamp': 'now()'
+            }, on_conflict='user_mail,folder_id').execute()
+            return state_data.data[0]
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error save delta link: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def get_processed_messages(self, email: str, message_ids: list, action: str):
+        try:
+            processed = set()
+            # Graph message ids are long, so keep each `in` filter URL short
+            for i in range(0, len(message_ids), 20):
+                ledger_data = supabase.table('processed_messages').select('message_id').eq('user_mail', email).eq('action', action).in_('message_id', message_ids[i:i + 20]).execute()
+                processed.update(row['message_id'] for row in ledger_data.data)
+            return processed
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error get processed messages: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def mark_message_processed(self, email: str, message_id: str, action: str):
+        try:
+            ledger_data = supabase.table('processed_messages').upsert({
+                'user_mail': email,
+                'message_id': message_id,
+                'action': action,
+                'timestamp': 'now()'
+            }, on_conflict='user_mail,message_id,action', ignore_duplicates=True).execute()
+            return ledger_data.data[0] if ledger_data.data else None
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error mark message processed: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def renew_processor_lease(self, worker_id: str):
+        try:
+            lease_data = supabase.table('processor_leases').upsert({
+                'worker_id': worker_id,
+                'heartbeat_at': datetime.now(timezone.utc).isoformat()
+            }, on_conflict='worker_id').execute()
+            return lease_data.data[0]
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error renew processor lease: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def get_live_processor_leases(self, ttl_seconds: float):
+        try:
+            since = datetime.now(timezone.utc) - timedelta(seconds=ttl_seconds)
+            lease_data = supabase.table('processor_leases').select('worker_id').gte('heartbeat_at', since.isoformat()).execute()
+            return [row['worker_id'] for row in lease_data.data]
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error get processor leases: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+    def release_processor_lease(self, worker_id: str):
+        try:
+            lease_data = supabase.table('processor_leases').delete().eq('worker_id', worker_id).execute()
+            return lease_data.data[0] if lease_data.data else None
+        except HTTPException:
+            raise
+        except Exception as e:
+            print(f"Error release processor lease: {e}")
+            raise HTTPException(detail=str(e), status_code=500)
+
+class AsyncSupabaseService:
+    """Async facade over SupabaseService.
+
+    Every blocking supabase call runs on a bounded thread pool so database I/O
+    overlaps with Graph and OpenAI I/O instead of stalling the event loop.
+    """
+
+    def __init__(self, service: SupabaseService):
+        self._service = service
+        self._executor = ThreadPoolExecutor(max_workers=SUPABASE_MAX_WORKERS, thread_name_prefix="supabase")
+
+    def __getattr__(self, name):
+        attr = getattr(self._service, name)
+        if not callable(attr) or inspect.iscoroutinefunction(attr) or inspect.isasyncgenfunction(attr):
+            return attr
+
+        @functools.wraps(attr)
+        async def call(*args, **kwargs):
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._executor, functools.partial(attr, *args, **kwargs))
+        return call
+
 supabase_service = SupabaseService()
+async_supabase_service = AsyncSupabaseService(supabase_service)
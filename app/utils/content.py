@@ -0,0 +1,191 @@
+import re
+import zlib
+from html.parser import HTMLParser
+
+try:
+    import tiktoken
+except ImportError:
+    tiktoken = None
+
+BLOCK_TAGS = {"br", "p", "div", "li", "tr", "table", "h1", "h2", "h3", "h4", "h5", "h6", "blockquote", "hr"}
+SKIP_TAGS = {"script", "style", "head", "title"}
+
+# Outlook wraps the quoted original message in one of these elements
+QUOTE_IDS = {"divrplyfwdmsg", "appendonsend", "mail-editor-reference-message-container"}
+
+# Lines that start a quoted reply chain
+QUOTE_HEADER_PATTERNS = [
+    re.compile(r"^On .{1,200} wrote:\s*$"),
+    re.compile(r"^-{2,}\s*Original Message\s*-{2,}\s*$", re.IGNORECASE),
+    re.compile(r"^_{10,}\s*$"),
+    re.compile(r"^From:\s.+$"),
+]
+
+SIGNATURE_PATTERNS = [
+    re.compile(r"^--\s*$"),
+    re.compile(r"^Sent from my \w+", re.IGNORECASE),
+    re.compile(r"^Get Outlook for \w+", re.IGNORECASE),
+]
+
+class _TextExtractor(HTMLParser):
+    def __init__(self) -> None:
+        super().__init__(convert_charrefs=True)
+        self.parts = []
+        self._skip = 0
+        self._stopped = False
+
+    def handle_starttag(self, tag, attrs):
+        if self._stopped:
+            return
+        if tag in SKIP_TAGS:
+            self._skip += 1
+        elif tag == "blockquote" or (dict(attrs).get("id") or "").lower() in QUOTE_IDS:
+            # Everything from here on is the quoted history
+            self._stopped = True
+        elif tag in BLOCK_TAGS:
+            self.parts.append("\n")
+
+    def handle_endtag(self, tag):
+        if tag in SKIP_TAGS and self._skip:
+            self._skip -= 1
+        elif tag in BLOCK_TAGS and not self._stopped:
+            self.parts.append("\n")
+
+    def handle_data(self, data):
+        if not self._skip and not self._stopped:
+            self.parts.append(data)
+
+def html_to_text(html: str):
+    """Visible text of an HTML email body, without the quoted original message"""
+    parser = _TextExtractor()
+    parser.feed(html)
+    parser.close()
+    return "".join(parser.parts)
+
+def strip_quoted_text(text: str):
+    """Cut a plain-text body at the first quoted reply header or signature delimiter"""
+    lines = []
+    for line in text.splitlines():
+        stripped = line.strip()
+        if stripped.startswith(">"):
+            continue
+        if any(pattern.match(stripped) for pattern in QUOTE_HEADER_PATTERNS + SIGNATURE_PATTERNS):
+            # A From: header at the very top is the message itself, not a quote
+            if lines or not stripped.startswith("From:"):
+                break
+        lines.append(line.rstrip())
+    return "\n".join(lines)
+
+def normalize_whitespace(text: str):
+    text = re.sub(r"[ \t\xa0]+", " ", text)
+    text = re.sub(r" *\n *", "\n", text)
+    return re.sub(r"\n{3,}", "\n\n", text).strip()
+
+DEFAULT_MODEL = "gpt-3.5-turbo"
+
+# tiktoken encodings by name, filled by load_encodings() at startup. Loading
+# one can download its BPE file, so it never happens on a request path:
+# until an encoding is loaded, tokens are estimated instead.
+_encodings = {}
+
+def _encoding_name(model: str):
+    try:
+        return tiktoken.encoding_name_for_model(model)
+    except KeyError:
+        return "cl100k_base"
+
+def load_encodings(*models: str):
+    """Load the tiktoken encodings for models; blocking, so run it off the event loop"""
+    if tiktoken is None:
+        return
+    for model in models or (DEFAULT_MODEL,):
+        name = _encoding_name(model)
+        if name in _encodings:
+            continue
+        try:
+            _encodings[name] = tiktoken.get_encoding(name)
+        except Exception as e:
+            print(f"Could not load tiktoken encoding {name}, estimating tokens instead: {e}")
+
+def _encoding(model: str):
+    if tiktoken is None:
+        return None
+    return _encodings.get(_encoding_name(model))
+
+def count_tokens(text: str, model: str = DEFAULT_MODEL):
+    """Tokens of text for model, estimated at four characters per token without its encoding"""
+    encoding = _encoding(model)
+    if encoding is None:
+        return len(text) // 4 + 1
+    return len(encoding.encode(text, disallowed_special=()))
+
+def fit_to_budget(text: str, max_tokens: int, model: str = DEFAULT_MODEL):
+    """Truncate text to at most max_tokens tokens"""
+    if count_tokens(text, model) <= max_tokens:
+        return text
+    encoding = _encoding(model)
+    if encoding is None:
+        return text[:max_tokens * 4] + "..."
+    return encoding.decode(encoding.encode(text, disallowed_special=())[:max_tokens]) + "..."
+
+def _split_long(text: str, max_tokens: int, model: str):
+    """Split one oversized paragraph on sentence boundaries, slicing any sentence still too long"""
+    pieces, current = [], ""
+    for sentence in re.split(r"(?<=[.!?])\s+", text):
+        while count_tokens(sentence, model) > max_tokens:
+            head = fit_to_budget(sentence, max_tokens, model)[:-3]
+            pieces.append(head)
+            sentence = sentence[len(head):]
+        candidate = f"{current} {sentence}".strip()
+        if current and count_tokens(candidate, model) > max_tokens:
+            pieces.append(current)
+            current = sentence
+        else:
+            current = candidate
+    if current:
+        pieces.append(current)
+    return pieces
+
+def split_text(text: str, max_tokens: int, model: str = DEFAULT_MODEL):
+    """Split text into chunks of at most max_tokens tokens on paragraph boundaries.
+
+    Once a chunk is half full it is closed after any paragraph whose hash
+    is divisible by 4, so boundaries depend on content rather than position:
+    an edit only changes the chunks around it and the rest keep their hash.
+    """
+    paragraphs = []
+    for paragraph in re.split(r"\n\s*\n", text):
+        paragraph = paragraph.strip()
+        if not paragraph:
+            continue
+        if count_tokens(paragraph, model) > max_tokens:
+            paragraphs.extend(_split_long(paragraph, max_tokens, model))
+        else:
+            paragraphs.append(paragraph)
+
+    chunks, current, size = [], [], 0
+    for paragraph in paragraphs:
+        tokens = count_tokens(paragraph, model)
+        if current and size + tokens > max_tokens:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+        current.append(paragraph)
+        size += tokens
+        if size >= max_tokens // 2 and zlib.crc32(paragraph.encode()) % 4 == 0:
+            chunks.append("\n\n".join(current))
+            current, size = [], 0
+    if current:
+        chunks.append("\n\n".join(current))
+    return chunks
+
+def prepare_email_content(content: str, max_tokens: int, content_type: str = "html", model: str = DEFAULT_MODEL):
+    """Email body reduced to its own text for a prompt.
+
+    HTML is converted to text, quoted reply chains and signatures are
+    removed, and the result is fitted to max_tokens.
+    """
+    if not content:
+        return ""
+    if content_type.lower() == "html" or re.search(r"<[a-zA-Z][^>]*>", content):
+        content = html_to_text(content)
+    return fit_to_budget(normalize_whitespace(strip_quoted_text(content)), max_tokens, model)
@@ -0,0 +1,46 @@
+"""Content-preparation benchmark on a corpus of sample emails.
+
+For every email in the corpus directory (.html files are treated as HTML
+bodies, anything else as plain text) it compares the tokens of the raw body,
+which prompts used to receive, with the tokens after prepare_email_content,
+and times the preparation itself.
+
+    python benchmarks/bench_content.py [--corpus benchmarks/corpus/emails] [--max-tokens 2000]
+"""
+import argparse
+import os
+import sys
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from app.utils.content import _encodings, count_tokens, load_encodings, prepare_email_content
+
+def main(args):
+    load_encodings()
+    print(f"token counter: {'tiktoken ' + ', '.join(_encodings) if _encodings else '4 characters per token estimate'}")
+    total_raw = total_prepared = 0
+    for name in sorted(os.listdir(args.corpus)):
+        with open(os.path.join(args.corpus, name), encoding="utf-8") as f:
+            content = f.read()
+        content_type = "html" if name.endswith(".html") else "text"
+        started = time.perf_counter()
+        for _ in range(args.repeat):
+            prepared = prepare_email_content(content, args.max_tokens, content_type)
+        elapsed = (time.perf_counter() - started) / args.repeat
+        raw_tokens, prepared_tokens = count_tokens(content), count_tokens(prepared)
+        total_raw += raw_tokens
+        total_prepared += prepared_tokens
+        print(
+            f"{name:<32} raw={raw_tokens:<6} prepared={prepared_tokens:<6} "
+            f"saved={1 - prepared_tokens / raw_tokens:>6.1%} prep={elapsed * 1e6:>8.1f}us"
+        )
+    print(f"{'total':<32} raw={total_raw:<6} prepared={total_prepared:<6} saved={1 - total_prepared / total_raw:>6.1%}")
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--corpus", default=os.path.join(ROOT, "benchmarks", "corpus", "emails"))
+    parser.add_argument("--max-tokens", type=int, default=2000)
+    parser.add_argument("--repeat", type=int, default=100)
+    main(parser.parse_args())
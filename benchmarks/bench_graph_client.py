@@ -0,0 +1,86 @@
+"""Local Graph stub benchmark for the shared pooled Graph client.
+
+Runs the same request load against a local fake Graph server twice: once
+opening a fresh httpx client per call (as GraphAuth used to), and once
+through the shared `graph_client`. Reports the TCP connections the server
+saw and p50/p99 latency for each.
+
+    python benchmarks/bench_graph_client.py [--requests 500] [--concurrency 20] [--latency 0.005]
+"""
+import argparse
+import asyncio
+import os
+import socket
+import statistics
+import sys
+import threading
+import time
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "tests")]
+# Measure the client, not the per-mailbox rate limit
+os.environ.setdefault("GRAPH_RATE_PER_SECOND", "1000000")
+os.environ.setdefault("GRAPH_RATE_BURST", "1000000")
+os.environ.setdefault("GRAPH_MAX_REQUESTS_PER_USER", "1000")
+
+import httpx
+import uvicorn
+from app.auth.graph_client import graph_client
+from fake_graph import FakeGraph
+
+def start_server(app):
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    server = uvicorn.Server(uvicorn.Config(app, host="127.0.0.1", port=port, log_level="warning"))
+    threading.Thread(target=server.run, daemon=True).start()
+    while not server.started:
+        time.sleep(0.01)
+    return server, f"http://127.0.0.1:{port}/v1.0/me/messages"
+
+async def run_load(call, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+
+    async def one(i):
+        async with semaphore:
+            started = time.perf_counter()
+            response = await call(i)
+            latencies.append(time.perf_counter() - started)
+            response.raise_for_status()
+
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return latencies
+
+def report(name: str, fake: FakeGraph, latencies: list):
+    connections = len({request[3] for request in fake.requests})
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<20} requests={len(latencies):<6} connections={connections:<6} "
+        f"p50={quantiles[49] * 1000:.2f}ms p99={quantiles[98] * 1000:.2f}ms"
+    )
+    fake.requests.clear()
+
+async def main(args):
+    fake = FakeGraph(latency=args.latency)
+    server, url = start_server(fake)
+
+    async def per_call_client(i):
+        async with httpx.AsyncClient() as client:
+            return await client.get(url)
+
+    async def shared_client(i):
+        return await graph_client.request(f"user{i % 50}@example.com", "GET", url)
+
+    report("client per call", fake, await run_load(per_call_client, args.requests, args.concurrency))
+    report("shared graph_client", fake, await run_load(shared_client, args.requests, args.concurrency))
+    await graph_client.close()
+    server.should_exit = True
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=500)
+    parser.add_argument("--concurrency", type=int, default=20)
+    parser.add_argument("--latency", type=float, default=0.005, help="server-side delay per response, in seconds")
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,189 @@
+"""Tick-throughput benchmark for the background email processor.
+
+Runs EmailProcessor for a fixed time against a stubbed Graph (FakeGraph
+with per-response latency), a stubbed OpenAI client and in-memory stand-ins
+for the Supabase calls, once per concurrency setting. Each user's inbox
+returns fresh unread messages on every run, so every run replies, flags
+and sorts. Reports completed user runs and processed messages per second.
+
+    python benchmarks/bench_processor_tick.py [--users 50] [--seconds 10] [--concurrency 1 8 32]
+
+Set BENCH_VERBOSE=1 to see the processor's own output.
+"""
+import argparse
+import asyncio
+import contextlib
+import itertools
+import json
+import os
+import sys
+import time
+import types
+from datetime import datetime, timezone
+from types import SimpleNamespace
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path[:0] = [ROOT, os.path.join(ROOT, "tests")]
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+os.environ.setdefault("EMAIL_SYNC_MODE", "full")
+os.environ.setdefault("PROCESSOR_TICK", "0.05")
+# app/api/supabase.py signs in to Supabase on import; every call the
+# processor makes is replaced with an in-memory stand-in below
+sys.modules["app.api.supabase"] = types.SimpleNamespace(supabase=None)
+
+import httpx
+import jwt
+from config import MS_TENANT_ID
+from app.auth import graph_auth as graph_auth_module
+from app.auth.graph_client import graph_client
+from app.processors.email_processor import EmailProcessor
+from app.services import openai_service as openai_service_module
+from app.services.supabase_service import async_supabase_service
+from fake_graph import FakeGraph
+
+FOLDERS = [
+    {"id": "inbox-id", "displayName": "Inbox"},
+    {"id": "clients-id", "displayName": "Clients"},
+    {"id": "newsletters-id", "displayName": "Newsletters"},
+]
+
+class StubMailbox:
+    """Graph responses for the calls one processor run makes"""
+
+    def __init__(self, messages_per_run: int) -> None:
+        self.messages_per_run = messages_per_run
+        self.ids = itertools.count()
+
+    def message(self, message_id: str):
+        return {
+            "id": message_id,
+            "subject": f"Question {message_id}",
+            "bodyPreview": "Could you send the quarterly figures?",
+            "body": {"contentType": "html", "content": "<p>Could you send the quarterly figures?</p>"},
+            "from": {"emailAddress": {"address": "client@example.com"}},
+            "isRead": False,
+            "receivedDateTime": datetime.now(timezone.utc).isoformat().replace("+00:00", "Z"),
+        }
+
+    def batch_item(self, item: dict):
+        if item["method"] == "GET" and item["url"].startswith("/me/mailFolders/"):
+            # Default folder lookup by well-known name
+            name = item["url"].removeprefix("/me/mailFolders/").split("?")[0]
+            return {"id": item["id"], "status": 200, "body": {"id": f"{name}-id"}}
+        return {"id": item["id"], "status": 200, "body": {}}
+
+    def __call__(self, method: str, path: str, body):
+        path = path.removeprefix("/v1.0/")
+        if path == "me/mailFolders/inbox":
+            return 200, {}, FOLDERS[0]
+        if path == "me/mailFolders":
+            return 200, {}, {"value": FOLDERS}
+        if path.endswith("/messages") and method == "GET":
+            return 200, {}, {"value": [self.message(f"m{next(self.ids)}") for _ in range(self.messages_per_run)]}
+        if path.startswith("me/messages/") and method == "GET":
+            return 200, {}, self.message(path.rsplit("/", 1)[-1])
+        if path == "$batch":
+            return 200, {}, {"responses": [self.batch_item(item) for item in body["requests"]]}
+        return 200, {}, {"id": "created"}
+
+class StubResponses:
+    """Stand-in for openai_client.responses with a fixed generation latency"""
+
+    def __init__(self, latency: float) -> None:
+        self.latency = latency
+        self.calls = 0
+
+    async def create(self, input, model, **kwargs):
+        self.calls += 1
+        await asyncio.sleep(self.latency)
+        prompt = input[0]["content"]
+        if "maps each email" in prompt:
+            text = json.dumps({str(n): "clients-id" for n in range(1, 101)})
+        elif "target folder's id" in prompt:
+            text = "clients-id"
+        else:
+            text = "Dear client,\n\nThank you, the figures are attached.\n\nBest regards"
+        return SimpleNamespace(output_text=text, usage=SimpleNamespace(total_tokens=200))
+
+def stub_supabase(users: list, counters: dict):
+    async def value(result):
+        return result
+
+    def returning(result):
+        return lambda *args, **kwargs: value(result)
+
+    async def mark_message_processed(email, message_id, action):
+        counters["actions"] += 1
+
+    stubs = {
+        "get_all_users": returning(users),
+        "get_schedules": returning([{"days": 3}]),
+        "get_reply_templates": returning([{"name": "Default", "subject": "Re", "body": "Thanks, we will get back to you."}]),
+        "get_delta_link": returning(None),
+        "save_delta_link": returning(None),
+        "get_processed_messages": returning([]),
+        "mark_message_processed": mark_message_processed,
+        "get_email_rules": returning([]),
+        "get_classifier_model": returning(None),
+        "merge_classifier_model": returning(None),
+        "log_activities": returning(None),
+        "update_access_token": returning(None),
+    }
+    for name, stub in stubs.items():
+        setattr(async_supabase_service, name, stub)
+
+async def run(concurrency: int, args):
+    token = jwt.encode({"exp": int(time.time()) + 3600}, "benchmark-signing-key-of-32-bytes", algorithm="HS256")
+    users = [
+        {"email": f"user{i}@example.com", "access_token": token, "refresh_token": "", "automation": True}
+        for i in range(args.users)
+    ]
+    counters = {"actions": 0, "runs": 0}
+    stub_supabase(users, counters)
+    # Tokens never expire during a run, so MSAL (and its network discovery) is not needed
+    graph_auth_module._msal_apps[f"https://login.microsoftonline.com/{MS_TENANT_ID or 'consumers'}"] = SimpleNamespace()
+    fake = FakeGraph(latency=args.graph_latency, handler=StubMailbox(args.messages))
+    graph_client._build_client = lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=fake))
+    responses = StubResponses(args.openai_latency)
+    openai_service_module.openai_client = SimpleNamespace(responses=responses)
+
+    processor = EmailProcessor()
+    processor.max_concurrency = concurrency
+    processor.check_interval = 0
+    finish_user = processor.finish_user
+
+    def count_finish(email):
+        counters["runs"] += 1
+        finish_user(email)
+    processor.finish_user = count_finish
+
+    # The processor logs every step; keep the report readable
+    with open(os.devnull, "w") as devnull, contextlib.redirect_stdout(sys.stdout if os.getenv("BENCH_VERBOSE") else devnull):
+        task = asyncio.create_task(processor.start())
+        started = time.monotonic()
+        await asyncio.sleep(args.seconds)
+        processor.stop()
+        await task
+        elapsed = time.monotonic() - started
+        await graph_client.close()
+    print(
+        f"concurrency={concurrency:<4} user runs/s={counters['runs'] / elapsed:<8.2f} "
+        f"actions/s={counters['actions'] / elapsed:<8.1f} graph requests={len(fake.requests):<7} "
+        f"openai calls={responses.calls}"
+    )
+
+async def main(args):
+    for concurrency in args.concurrency:
+        await run(concurrency, args)
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--users", type=int, default=50)
+    parser.add_argument("--messages", type=int, default=3, help="new unread messages per user run")
+    parser.add_argument("--seconds", type=float, default=10)
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--graph-latency", type=float, default=0.02)
+    parser.add_argument("--openai-latency", type=float, default=0.3)
+    asyncio.run(main(parser.parse_args()))
@@ -0,0 +1,118 @@
+"""Concurrent data-layer benchmark against a local PostgREST stand-in.
+
+Serves `/rest/v1/<table>` from a small FastAPI app in a separate process,
+with a fixed per-response latency, and points a real supabase client at it. The same batch of
+concurrent `get_user` lookups (distinct emails, so the settings cache never
+hits) then runs twice: awaiting `async_supabase_service`, and calling the
+sync `supabase_service` straight from coroutines as the handlers used to.
+All lookups are submitted at once, so latency is measured from submission.
+Reports throughput, p50/p99 latency and the worst event loop stall seen by
+a 10 ms ticker during each run.
+
+    python benchmarks/bench_supabase.py [--requests 200] [--concurrency 50] [--latency 0.02]
+"""
+import argparse
+import asyncio
+import multiprocessing
+import os
+import socket
+import statistics
+import sys
+import time
+import types
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+os.environ.setdefault("SUPABASE_KEY", "benchmark")
+os.environ.setdefault("OPENAI_API_KEY", "benchmark")
+
+import uvicorn
+from fastapi import FastAPI
+from supabase import create_client
+
+def postgrest_stand_in(latency: float):
+    app = FastAPI()
+
+    @app.get("/rest/v1/{table}")
+    async def select(table: str, email: str = None):
+        await asyncio.sleep(latency)
+        return [{"email": (email or "").removeprefix("eq."), "access_token": "token", "refresh_token": "refresh"}]
+
+    return app
+
+def serve(port: int, latency: float):
+    uvicorn.run(postgrest_stand_in(latency), host="127.0.0.1", port=port, log_level="warning")
+
+def start_server(latency: float):
+    """Run the stand-in in its own process so it does not compete for the GIL"""
+    sock = socket.socket()
+    sock.bind(("127.0.0.1", 0))
+    port = sock.getsockname()[1]
+    sock.close()
+    process = multiprocessing.Process(target=serve, args=(port, latency), daemon=True)
+    process.start()
+    while True:
+        try:
+            socket.create_connection(("127.0.0.1", port)).close()
+            break
+        except OSError:
+            time.sleep(0.05)
+    return process, f"http://127.0.0.1:{port}"
+
+async def run_load(call, requests: int, concurrency: int):
+    semaphore = asyncio.Semaphore(concurrency)
+    latencies = []
+    stall = 0.0
+    done = asyncio.Event()
+
+    async def ticker():
+        nonlocal stall
+        while not done.is_set():
+            started = time.perf_counter()
+            await asyncio.sleep(0.01)
+            stall = max(stall, time.perf_counter() - started - 0.01)
+
+    async def one(i):
+        async with semaphore:
+            user = await call(f"user{i}-{time.monotonic_ns()}@example.com")
+            latencies.append(time.perf_counter() - started)
+            assert user["access_token"] == "token"
+
+    ticking = asyncio.create_task(ticker())
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    elapsed = time.perf_counter() - started
+    done.set()
+    await ticking
+    return latencies, elapsed, stall
+
+def report(name: str, latencies: list, elapsed: float, stall: float):
+    quantiles = statistics.quantiles(latencies, n=100)
+    print(
+        f"{name:<26} requests/s={len(latencies) / elapsed:<8.1f} p50={quantiles[49] * 1000:.1f}ms "
+        f"p99={quantiles[98] * 1000:.1f}ms max loop stall={stall * 1000:.1f}ms"
+    )
+
+async def main(args):
+    server, url = start_server(args.latency)
+    # app/api/supabase.py signs in on import; use an unauthenticated client on the stand-in instead
+    key = "eyJhbGciOiJIUzI1NiJ9.eyJyb2xlIjoiYW5vbiJ9.benchmark"
+    sys.modules["app.api.supabase"] = types.SimpleNamespace(supabase=create_client(url, key))
+    from app.services.supabase_service import async_supabase_service, supabase_service
+
+    async def through_async_service(email):
+        return await async_supabase_service.get_user(email)
+
+    async def through_sync_service(email):
+        return supabase_service.get_user(email)
+
+    report("async_supabase_service", *await run_load(through_async_service, args.requests, args.concurrency))
+    report("sync supabase_service", *await run_load(through_sync_service, args.requests, args.concurrency))
+    server.terminate()
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--requests", type=int, default=200)
+    parser.add_argument("--concurrency", type=int, default=50)
+    parser.add_argument("--latency", type=float, default=0.02, help="server-side delay per response, in seconds")
+    asyncio.run(main(parser.parse_args()))
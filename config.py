@@ -19,3 +19,82 @@ SUPABASE_PASSWORD = os.getenv("SUPABASE_PASSWORD")
 ACCESS_TOKEN_EXPIRE_MINUTES = 129600 # 90 days
 ALGORITHM = "HS512"
 SECRET_KEY = os.getenv("SECRET_KEY")
+
+# Microsoft Graph HTTP client settings
+GRAPH_MAX_CONNECTIONS = int(os.getenv("GRAPH_MAX_CONNECTIONS", "100"))
+GRAPH_MAX_KEEPALIVE_CONNECTIONS = int(os.getenv("GRAPH_MAX_KEEPALIVE_CONNECTIONS", "20"))
+GRAPH_KEEPALIVE_EXPIRY = float(os.getenv("GRAPH_KEEPALIVE_EXPIRY", "60"))
+GRAPH_MAX_REQUESTS_PER_USER = int(os.getenv("GRAPH_MAX_REQUESTS_PER_USER", "4"))
+GRAPH_TIMEOUT = float(os.getenv("GRAPH_TIMEOUT", "30"))
+GRAPH_RATE_PER_SECOND = float(os.getenv("GRAPH_RATE_PER_SECOND", "10")) # per mailbox
+GRAPH_RATE_BURST = int(os.getenv("GRAPH_RATE_BURST", "20"))
+GRAPH_MAX_RETRIES = int(os.getenv("GRAPH_MAX_RETRIES", "4"))
+GRAPH_BATCH_SIZE = min(int(os.getenv("GRAPH_BATCH_SIZE", "20")), 20) # Graph allows at most 20 per $batch
+GRAPH_BATCH_RETRIES = int(os.getenv("GRAPH_BATCH_RETRIES", "3"))
+TOKEN_VALIDATION_TTL = int(os.getenv("TOKEN_VALIDATION_TTL", "300"))
+TOKEN_EXPIRY_SKEW = int(os.getenv("TOKEN_EXPIRY_SKEW", "60"))
+
+# Email processor settings
+EMAIL_SYNC_MODE = os.getenv("EMAIL_SYNC_MODE", "delta") # "delta" | "full"
+EMAIL_PAGE_SIZE = int(os.getenv("EMAIL_PAGE_SIZE", "50"))
+EMAIL_DELTA_PAGE_SIZE = int(os.getenv("EMAIL_DELTA_PAGE_SIZE", "50"))
+EMAIL_DELTA_INITIAL_DAYS = int(os.getenv("EMAIL_DELTA_INITIAL_DAYS", "7"))
+LEDGER_CACHE_SIZE = int(os.getenv("LEDGER_CACHE_SIZE", "100000"))
+PROCESSOR_MAX_CONCURRENCY = int(os.getenv("PROCESSOR_MAX_CONCURRENCY", "8"))
+PROCESSOR_USER_TIMEOUT = float(os.getenv("PROCESSOR_USER_TIMEOUT", "300"))
+PROCESSOR_TICK = float(os.getenv("PROCESSOR_TICK", "1"))
+PROCESSOR_MODE = os.getenv("PROCESSOR_MODE", "inline") # "inline" | "worker"
+PROCESSOR_SHUTDOWN_TIMEOUT = float(os.getenv("PROCESSOR_SHUTDOWN_TIMEOUT", "30"))
+WORKER_INDEX = int(os.getenv("WORKER_INDEX", "0"))
+WORKER_COUNT = int(os.getenv("WORKER_COUNT", "1"))
+PROCESSOR_PARTITIONING = os.getenv("PROCESSOR_PARTITIONING", "static") # "static" | "lease"
+WORKER_ID = os.getenv("WORKER_ID")
+LEASE_TTL = float(os.getenv("LEASE_TTL", "30"))
+LEASE_HEARTBEAT_INTERVAL = float(os.getenv("LEASE_HEARTBEAT_INTERVAL", "10"))
+LEASE_VIRTUAL_NODES = int(os.getenv("LEASE_VIRTUAL_NODES", "64"))
+SUPABASE_MAX_WORKERS = int(os.getenv("SUPABASE_MAX_WORKERS", "16"))
+
+# Activity log settings
+ACTIVITY_LOG_BATCH_SIZE = int(os.getenv("ACTIVITY_LOG_BATCH_SIZE", "100"))
+ACTIVITY_LOG_FLUSH_INTERVAL = float(os.getenv("ACTIVITY_LOG_FLUSH_INTERVAL", "5"))
+ACTIVITY_LOG_MAX_BUFFER = int(os.getenv("ACTIVITY_LOG_MAX_BUFFER", "10000"))
+ACTIVITY_LOG_SPOOL_PATH = os.getenv("ACTIVITY_LOG_SPOOL_PATH")
+
+# Pagination settings for chat history and activity feeds
+PAGE_SIZE_DEFAULT = int(os.getenv("PAGE_SIZE_DEFAULT", "50"))
+PAGE_SIZE_MAX = int(os.getenv("PAGE_SIZE_MAX", "200"))
+
+# Cache of per-user settings rows (users, schedules, reply templates)
+SETTINGS_CACHE_SIZE = int(os.getenv("SETTINGS_CACHE_SIZE", "10000"))
+SETTINGS_CACHE_TTL = float(os.getenv("SETTINGS_CACHE_TTL", "60"))
+
+# Mail folder caches
+FOLDER_COUNTS_TTL = float(os.getenv("FOLDER_COUNTS_TTL", "30"))
+FOLDER_CACHE_TTL = float(os.getenv("FOLDER_CACHE_TTL", "300"))
+
+# Email sorting settings
+SORT_BATCH_SIZE = int(os.getenv("SORT_BATCH_SIZE", "20")) # emails per classification request; 1 disables batching
+CLASSIFIER_CONFIDENCE = float(os.getenv("CLASSIFIER_CONFIDENCE", "0.9"))
+CLASSIFIER_MIN_SAMPLES = int(os.getenv("CLASSIFIER_MIN_SAMPLES", "20"))
+CLASSIFIER_MAX_FEATURES = int(os.getenv("CLASSIFIER_MAX_FEATURES", "5000")) # per folder
+CLASSIFIER_MODEL_TTL = float(os.getenv("CLASSIFIER_MODEL_TTL", "300")) # seconds before a worker reloads a model others may have trained
+
+# Cache of LLM responses keyed by model and normalized prompt
+LLM_CACHE_SIZE = int(os.getenv("LLM_CACHE_SIZE", "2000"))
+LLM_CACHE_TTL = float(os.getenv("LLM_CACHE_TTL", "86400"))
+LLM_CACHE_PATH = os.getenv("LLM_CACHE_PATH") # sqlite file for a persistent tier; unset keeps the cache in memory only
+
+# OpenAI request scheduling (0 disables a per-minute budget)
+LLM_MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "8"))
+LLM_RPM_LIMIT = int(os.getenv("LLM_RPM_LIMIT", "0"))
+LLM_TPM_LIMIT = int(os.getenv("LLM_TPM_LIMIT", "0"))
+LLM_MAX_RETRIES = int(os.getenv("LLM_MAX_RETRIES", "4"))
+
+# Prompt content budgets, in tokens
+EMAIL_CONTENT_MAX_TOKENS = int(os.getenv("EMAIL_CONTENT_MAX_TOKENS", "2000"))
+DOCUMENT_MAX_TOKENS = int(os.getenv("DOCUMENT_MAX_TOKENS", "3000"))
+
+# Map-reduce summarization of long documents and transcripts
+SUMMARY_CHUNK_TOKENS = int(os.getenv("SUMMARY_CHUNK_TOKENS", "2000"))
+SUMMARY_MAX_PARALLEL = int(os.getenv("SUMMARY_MAX_PARALLEL", "4"))
+SUMMARY_CACHE_TTL = float(os.getenv("SUMMARY_CACHE_TTL", "604800")) # chunk summaries are keyed by content, so keep them a week
@@ -8,46 +8,38 @@ import os
 import json
 import socketio
 import uvicorn
+from config import PROCESSOR_MODE, PROCESSOR_SHUTDOWN_TIMEOUT
+from app.auth.graph_client import graph_client
 from app.processors.email_processor import email_processor
+from app.services.activity_logger import activity_logger
+from app.utils.content import load_encodings
 from app.services.dg_service import finish_deepgram, process_audio_chunk
 from app.services.openai_service import openai_service
 
 # Import your routes
 from app.api.routes import router as api_router
 
-async def start_email_processor():
-    """Start the email processor"""
-    await email_processor.start()
-
-def start_background_tasks():
-    """Start background tasks when FastAPI starts"""
-    from threading import Thread
-    
-    def run_processor():
-        loop = asyncio.new_event_loop()
-        asyncio.set_event_loop(loop)
-        loop.run_until_complete(start_email_processor())
-
-    thread = Thread(target=run_processor, daemon=True)
-    thread.start()
-
-async def verify_credentials():
-    """Verify the Microsoft Graph credentials"""
-    try:
-        await asyncio.sleep(400)
-        start_background_tasks()
-        return True
-    except Exception as e:
-        return False
-
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     print("Setting up Email AI Agent...")
-    asyncio.create_task(verify_credentials())
+    await asyncio.to_thread(load_encodings)
+    await activity_logger.start()
+    processor_task = None
+    if PROCESSOR_MODE == "inline":
+        # Standalone workers are started with `python -m app.processors.worker`
+        processor_task = asyncio.create_task(email_processor.start())
     print("\n--- Email AI Agent Ready ---")
     print("FastAPI Swagger docs: http://localhost:8000/docs")
     print("WebSocket: Listening on ws://localhost:8000")
     yield
+    if processor_task:
+        email_processor.stop()
+        try:
+            await asyncio.wait_for(processor_task, timeout=PROCESSOR_SHUTDOWN_TIMEOUT)
+        except asyncio.TimeoutError:
+            print("Email processor did not stop in time, cancelling")
+    await activity_logger.stop()
+    await graph_client.close()
 
 # Initialize FastAPI app
 fastapi_app = FastAPI(
@@ -117,6 +109,19 @@ async def disconnect(sid):
 @sio.event
 async def chat_message(sid, data):
     print(f"Received message from {sid}: {data['message']}")
+    if data.get('stream'):
+        # The client waits for chat_response_done or chat_response_error
+        chunks = []
+        try:
+            async for delta in openai_service.stream_chat_message(data['message']):
+                chunks.append(delta)
+                await sio.emit('chat_response_delta', {'delta': delta}, room=sid)
+        except Exception as e:
+            print(f"Error streaming chat response: {e}")
+            await sio.emit('chat_response_error', {'error': str(e)}, room=sid)
+            return
+        await sio.emit('chat_response_done', {'response': ''.join(chunks)}, room=sid)
+        return
     response = await openai_service.process_chat_message(data['message'])
     await sio.emit('chat_response', {'response': response}, room=sid)
 
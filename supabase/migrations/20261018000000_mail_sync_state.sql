@@ -0,0 +1,9 @@
+-- Graph delta links used by the email processor for incremental inbox sync
+create table if not exists mail_sync_state (
+    id bigint generated by default as identity primary key,
+    user_mail text not null,
+    folder_id text not null,
+    delta_link text,
+    timestamp timestamptz not null default now(),
+    unique (user_mail, folder_id)
+);
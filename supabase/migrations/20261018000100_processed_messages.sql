@@ -0,0 +1,9 @@
+-- Idempotency ledger of the actions the email processor applied to each message
+create table if not exists processed_messages (
+    id bigint generated by default as identity primary key,
+    user_mail text not null,
+    message_id text not null,
+    action text not null,
+    timestamp timestamptz not null default now(),
+    unique (user_mail, message_id, action)
+);
@@ -0,0 +1,5 @@
+-- Heartbeat leases of the running email processor workers
+create table if not exists processor_leases (
+    worker_id text primary key,
+    heartbeat_at timestamptz not null default now()
+);
@@ -0,0 +1,62 @@
+-- Per-user activity counters maintained on insert into activity_logs, so the
+-- activity summary never has to scan the log itself.
+create table if not exists activity_totals (
+    user_mail text not null,
+    activity text not null,
+    count bigint not null default 0,
+    primary key (user_mail, activity)
+);
+
+create table if not exists activity_counters (
+    user_mail text not null,
+    activity text not null,
+    day date not null,
+    count bigint not null default 0,
+    primary key (user_mail, activity, day)
+);
+
+create or replace function bump_activity_counters() returns trigger
+language plpgsql as $$
+begin
+    insert into activity_counters (user_mail, activity, day, count)
+    select user_mail, activity, (timestamp at time zone 'utc')::date, count(*)
+    from inserted_logs
+    group by 1, 2, 3
+    on conflict (user_mail, activity, day)
+    do update set count = activity_counters.count + excluded.count;
+
+    insert into activity_totals (user_mail, activity, count)
+    select user_mail, activity, count(*)
+    from inserted_logs
+    group by 1, 2
+    on conflict (user_mail, activity)
+    do update set count = activity_totals.count + excluded.count;
+
+    return null;
+end;
+$$;
+
+drop trigger if exists activity_logs_bump_counters on activity_logs;
+create trigger activity_logs_bump_counters
+    after insert on activity_logs
+    referencing new table as inserted_logs
+    for each statement execute function bump_activity_counters();
+
+-- Rebuild every counter from the raw log. Run once after this migration and
+-- whenever the counters need repairing (e.g. after deleting log rows).
+create or replace function rollup_activity_counters() returns void
+language sql as $$
+    truncate activity_counters, activity_totals;
+
+    insert into activity_counters (user_mail, activity, day, count)
+    select user_mail, activity, (timestamp at time zone 'utc')::date, count(*)
+    from activity_logs
+    group by 1, 2, 3;
+
+    insert into activity_totals (user_mail, activity, count)
+    select user_mail, activity, count(*)
+    from activity_logs
+    group by 1, 2;
+$$;
+
+select rollup_activity_counters();
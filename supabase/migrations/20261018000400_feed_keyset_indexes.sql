@@ -0,0 +1,6 @@
+-- Indexes backing keyset pagination of the chat history and activity feeds
+create index if not exists chat_history_user_mail_timestamp_id_idx
+    on chat_history (user_mail, timestamp desc, id desc);
+
+create index if not exists activity_logs_user_mail_timestamp_id_idx
+    on activity_logs (user_mail, timestamp desc, id desc);
@@ -0,0 +1,18 @@
+-- User sorting rules (app.models.schema.EmailRule) and the learned per-user
+-- sorting model used before falling back to the LLM
+create table if not exists email_rules (
+    id bigint generated by default as identity primary key,
+    user_mail text not null,
+    field text not null,
+    value text not null,
+    target_folder text not null,
+    timestamp timestamptz not null default now()
+);
+
+create index if not exists email_rules_user_mail_idx on email_rules (user_mail);
+
+create table if not exists classifier_models (
+    user_mail text primary key,
+    model jsonb not null,
+    timestamp timestamptz not null default now()
+);
@@ -0,0 +1,69 @@
+-- Add a batch of learned counts to a user's sorting model in place. Workers
+-- send only what they learned in a run, so the payload stays small and two
+-- workers training the same user's model never overwrite each other.
+-- p_delta has the model's shape: {"class_counts": {folder: n},
+-- "feature_counts": {folder: {feature: n}}}. A folder holding more than
+-- p_max_features features keeps only its most frequent half.
+create or replace function merge_classifier_model(p_user_mail text, p_delta jsonb, p_max_features int)
+returns void
+language plpgsql as $$
+declare
+    current_model jsonb;
+    folder text;
+    features jsonb;
+begin
+    insert into classifier_models (user_mail, model)
+    values (p_user_mail, '{"class_counts": {}, "feature_counts": {}}'::jsonb)
+    on conflict (user_mail) do nothing;
+
+    select model into current_model
+    from classifier_models
+    where user_mail = p_user_mail
+    for update;
+
+    current_model := jsonb_build_object(
+        'class_counts', (
+            select coalesce(jsonb_object_agg(key, total), '{}'::jsonb)
+            from (
+                select key, sum(value::bigint) as total
+                from (
+                    select * from jsonb_each_text(coalesce(current_model->'class_counts', '{}'::jsonb))
+                    union all
+                    select * from jsonb_each_text(coalesce(p_delta->'class_counts', '{}'::jsonb))
+                ) counts
+                group by key
+            ) totals
+        ),
+        'feature_counts', coalesce(current_model->'feature_counts', '{}'::jsonb)
+    );
+
+    for folder in select jsonb_object_keys(coalesce(p_delta->'feature_counts', '{}'::jsonb)) loop
+        select coalesce(jsonb_object_agg(key, total), '{}'::jsonb) into features
+        from (
+            select key, sum(value::bigint) as total
+            from (
+                select * from jsonb_each_text(coalesce(current_model->'feature_counts'->folder, '{}'::jsonb))
+                union all
+                select * from jsonb_each_text(p_delta->'feature_counts'->folder)
+            ) counts
+            group by key
+        ) totals;
+
+        if (select count(*) from jsonb_object_keys(features)) > p_max_features then
+            select jsonb_object_agg(key, value) into features
+            from (
+                select key, value
+                from jsonb_each(features)
+                order by value::bigint desc
+                limit p_max_features / 2
+            ) kept;
+        end if;
+
+        current_model := jsonb_set(current_model, array['feature_counts', folder], features);
+    end loop;
+
+    update classifier_models
+    set model = current_model, timestamp = now()
+    where user_mail = p_user_mail;
+end;
+$$;
@@ -0,0 +1,17 @@
+import os
+import sys
+import types
+
+# Settings the app reads at import time; no real service is contacted in tests
+os.environ.setdefault("SUPABASE_URL", "http://localhost:54321")
+os.environ.setdefault("SUPABASE_KEY", "test")
+os.environ.setdefault("OPENAI_API_KEY", "test")
+os.environ.setdefault("SECRET_KEY", "test-secret-key-long-enough-for-hs512-signatures-0123456789abcdef")
+
+# app/api/supabase.py signs in to Supabase on import, so tests use an
+# unconnected stand-in; anything that really queries Supabase is patched per test
+supabase_module = types.ModuleType("app.api.supabase")
+supabase_module.supabase = None
+sys.modules.setdefault("app.api.supabase", supabase_module)
+
+sys.path.insert(0, os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
@@ -0,0 +1,60 @@
+import asyncio
+import json
+import time
+
+class FakeGraph:
+    """Minimal ASGI stand-in for Microsoft Graph.
+
+    Every request is recorded as (monotonic time, method, path, client
+    address). Responses are scripted per path as a list of (status, headers)
+    consumed in order; once a script is used up, or for unscripted paths,
+    the server answers with `handler(method, path, body)` if one is given
+    and otherwise 200 with an empty message list. `latency` delays every
+    response, like a real network round trip would.
+    """
+
+    def __init__(self, latency: float = 0.0, handler=None) -> None:
+        self.latency = latency
+        self.handler = handler
+        self.requests = []
+        self.scripts = {}
+
+    def script(self, path: str, *responses):
+        self.scripts[path] = list(responses)
+
+    def hits(self, path: str):
+        return [request for request in self.requests if request[2] == path]
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] == "lifespan":
+            while True:
+                message = await receive()
+                await send({"type": message["type"] + ".complete"})
+                if message["type"] == "lifespan.shutdown":
+                    return
+        self.requests.append((time.monotonic(), scope["method"], scope["path"], scope.get("client")))
+        request_body = b""
+        while True:
+            message = await receive()
+            request_body += message.get("body", b"")
+            if not message.get("more_body"):
+                break
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        script = self.scripts.get(scope["path"])
+        if script:
+            status, headers = script.pop(0)
+            payload = {"value": []} if status < 400 else {"error": {"code": str(status)}}
+        elif self.handler:
+            status, headers, payload = self.handler(scope["method"], scope["path"], json.loads(request_body or b"null"))
+        else:
+            status, headers, payload = 200, {}, {"value": []}
+        body = json.dumps(payload).encode()
+        await send({
+            "type": "http.response.start",
+            "status": status,
+            "headers": [(b"content-type", b"application/json")] + [
+                (name.lower().encode(), str(value).encode()) for name, value in headers.items()
+            ]
+        })
+        await send({"type": "http.response.body", "body": body})
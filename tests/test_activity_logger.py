@@ -0,0 +1,81 @@
+import asyncio
+import json
+import pytest
+from app.services import activity_logger as activity_logger_module
+from app.services.activity_logger import ActivityLogger
+from app.services.supabase_service import async_supabase_service
+
+@pytest.fixture
+def inserts(monkeypatch):
+    inserted = {"rows": [], "fail": False}
+
+    async def log_activities(rows):
+        await asyncio.sleep(0)
+        if inserted["fail"]:
+            raise RuntimeError("database unavailable")
+        inserted["rows"].extend(rows)
+
+    monkeypatch.setattr(async_supabase_service, "log_activities", log_activities, raising=False)
+    return inserted
+
+def details(logger: ActivityLogger):
+    return [event["details"] for event in logger._buffer]
+
+def test_failed_flush_drops_the_oldest_events(inserts, monkeypatch):
+    monkeypatch.setattr(activity_logger_module, "ACTIVITY_LOG_MAX_BUFFER", 3)
+    monkeypatch.setattr(activity_logger_module, "ACTIVITY_LOG_BATCH_SIZE", 2)
+    logger = ActivityLogger()
+    for n in range(3):
+        logger.log("a@example.com", "sort_email", str(n))
+    inserts["fail"] = True
+
+    async def flush_while_logging():
+        flush = asyncio.create_task(logger.flush())
+        await asyncio.sleep(0)
+        logger.log("a@example.com", "sort_email", "3")
+        logger.log("a@example.com", "sort_email", "4")
+        await flush
+
+    asyncio.run(flush_while_logging())
+
+    assert details(logger) == ["2", "3", "4"]
+    assert logger.dropped == 2
+
+def test_spool_is_written_by_flush_and_replayed(inserts, monkeypatch, tmp_path):
+    spool = tmp_path / "activity.jsonl"
+    monkeypatch.setattr(activity_logger_module, "ACTIVITY_LOG_SPOOL_PATH", str(spool))
+    logger = ActivityLogger()
+    logger.log("a@example.com", "sort_email", "0")
+    assert not spool.exists()
+
+    inserts["fail"] = True
+    asyncio.run(logger.flush())
+    assert [json.loads(line)["details"] for line in spool.read_text().splitlines()] == ["0"]
+
+    restarted = ActivityLogger()
+    inserts["fail"] = False
+    asyncio.run(restarted._replay_spool())
+    asyncio.run(restarted.flush())
+    assert [row["details"] for row in inserts["rows"]] == ["0"]
+    assert spool.read_text() == ""
+
+def test_spool_errors_do_not_stop_the_flush(inserts, monkeypatch, tmp_path):
+    monkeypatch.setattr(activity_logger_module, "ACTIVITY_LOG_SPOOL_PATH", str(tmp_path / "missing" / "activity.jsonl"))
+    logger = ActivityLogger()
+    logger.log("a@example.com", "sort_email", "0")
+
+    asyncio.run(logger.flush())
+
+    assert [row["details"] for row in inserts["rows"]] == ["0"]
+    assert logger.stats() == {"buffered": 0, "dropped": 0}
+
+def test_metrics_report_dropped_events(monkeypatch):
+    from fastapi import FastAPI
+    from fastapi.testclient import TestClient
+    from app.api.routes import router
+
+    monkeypatch.setattr(activity_logger_module.activity_logger, "dropped", 7)
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+
+    assert TestClient(app).get("/api/metrics").json()["activity_log"]["dropped"] == 7
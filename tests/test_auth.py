@@ -0,0 +1,64 @@
+import asyncio
+import pytest
+from types import SimpleNamespace
+from fastapi import HTTPException
+from app.api import auth
+from config import MS_TENANT_ID
+from app.auth import graph_auth as graph_auth_module
+from app.auth.graph_auth import GraphAuth
+from app.services import supabase_service as supabase_service_module
+from app.services.supabase_service import supabase_service
+
+class UsersTable:
+    """Stand-in for supabase.table('users').select('*').eq('email', ...).execute()"""
+
+    def __init__(self, row: dict) -> None:
+        self.row = row
+        self.reads = 0
+
+    def table(self, name):
+        return self
+
+    def select(self, columns):
+        return self
+
+    def eq(self, column, value):
+        return self
+
+    def execute(self):
+        self.reads += 1
+        return SimpleNamespace(data=[dict(self.row)])
+
+@pytest.fixture
+def users(monkeypatch):
+    table = UsersTable({"email": "a@example.com", "access_token": "expired", "refresh_token": "refresh"})
+    monkeypatch.setattr(supabase_service_module, "supabase", table)
+    supabase_service.invalidate_settings("a@example.com")
+
+    async def check_token(self, token):
+        return token == "fresh"
+
+    monkeypatch.setattr(GraphAuth, "check_token", check_token)
+    # Skip MSAL's network discovery; no token is refreshed here
+    monkeypatch.setitem(graph_auth_module._msal_apps, f"https://login.microsoftonline.com/{MS_TENANT_ID or 'consumers'}", SimpleNamespace())
+    yield table
+    supabase_service.invalidate_settings("a@example.com")
+
+def test_token_refreshed_elsewhere_is_reread(users):
+    token = auth.create_jwt_token({"email": "a@example.com"})
+    supabase_service.get_user("a@example.com")
+    users.row["access_token"] = "fresh"
+
+    graph_auth = asyncio.run(auth.get_current_graph(token))
+
+    assert graph_auth.token == "fresh"
+    assert users.reads == 2
+
+def test_invalid_token_in_the_database_is_rejected(users):
+    token = auth.create_jwt_token({"email": "a@example.com"})
+
+    with pytest.raises(HTTPException) as error:
+        asyncio.run(auth.get_current_graph(token))
+
+    assert error.value.status_code == 401
+    assert users.reads == 2
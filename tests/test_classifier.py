@@ -0,0 +1,57 @@
+import asyncio
+import pytest
+from app.models.schema import EmailMessage
+from app.services.classifier_service import ClassifierService, SortModel
+from app.services.supabase_service import async_supabase_service
+
+def message(subject: str, sender: str):
+    return EmailMessage(id=subject, subject=subject, body="", to_recipients=[], sender=sender)
+
+@pytest.fixture
+def stored_model(monkeypatch):
+    stored = {"model": {"class_counts": {"news-id": 5}, "feature_counts": {"news-id": {"w:weekly": 5}}}, "merged": []}
+
+    async def get_classifier_model(email):
+        return stored["model"]
+
+    async def merge_classifier_model(email, delta, max_features):
+        stored["merged"].append(delta)
+
+    monkeypatch.setattr(async_supabase_service, "get_classifier_model", get_classifier_model, raising=False)
+    monkeypatch.setattr(async_supabase_service, "merge_classifier_model", merge_classifier_model, raising=False)
+    return stored
+
+def test_learn_persists_only_the_new_counts(stored_model):
+    service = ClassifierService()
+
+    asyncio.run(service.learn("a@example.com", [(message("Invoice 42", "billing@acme.com"), "bills-id")]))
+
+    assert stored_model["merged"] == [{
+        "class_counts": {"bills-id": 1},
+        "feature_counts": {"bills-id": {"sender:billing@acme.com": 1, "domain:acme.com": 1, "w:invoice": 1, "w:42": 1, "b:invoice_42": 1}},
+    }]
+
+def test_cached_model_expires(stored_model):
+    service = ClassifierService()
+    service._models.ttl = 0.01
+
+    first = asyncio.run(service._get_model("a@example.com"))
+    asyncio.run(asyncio.sleep(0.02))
+    second = asyncio.run(service._get_model("a@example.com"))
+
+    assert first is not second
+
+def test_predict_reuses_stats_until_the_model_learns():
+    model = SortModel({"class_counts": {"news-id": 3, "bills-id": 3}, "feature_counts": {
+        "news-id": {"w:weekly": 3, "w:digest": 3},
+        "bills-id": {"w:invoice": 3},
+    }})
+
+    assert model.predict(message("Weekly digest", "news@example.com"), {"news-id", "bills-id"})[0] == "news-id"
+    stats = model.stats()
+    model.predict(message("Invoice", "billing@acme.com"), {"news-id", "bills-id"})
+    assert model.stats() is stats
+
+    model.learn(message("Invoice", "billing@acme.com"), "bills-id")
+    assert model.stats() is not stats
+    assert model.stats()[1]["bills-id"] == 6
@@ -0,0 +1,21 @@
+from app.utils import content
+
+def test_failed_encoding_load_falls_back_to_estimate(monkeypatch):
+    def unavailable(name):
+        raise ConnectionError("no route to the BPE host")
+
+    monkeypatch.setattr(content, "_encodings", {})
+    monkeypatch.setattr(content.tiktoken, "get_encoding", unavailable)
+    content.load_encodings()
+
+    assert content.count_tokens("a" * 400) == 101
+    assert content.fit_to_budget("a" * 400, 10) == "a" * 40 + "..."
+
+def test_prepare_email_content_drops_markup_quotes_and_signature():
+    html = (
+        "<html><head><style>p{margin:0}</style></head><body><p>Can we meet&nbsp;Tuesday?</p>"
+        "<p>Thanks,<br>Ann</p><div>-- </div><div>Ann Lee | CFO</div>"
+        "<div id=\"divRplyFwdMsg\"><b>From:</b> Tom</div><p>Earlier message</p></body></html>"
+    )
+
+    assert content.prepare_email_content(html, 100) == "Can we meet Tuesday?\n\nThanks,\nAnn"
@@ -0,0 +1,44 @@
+import asyncio
+import pytest
+from app.auth.graph_auth import GraphAPIError
+from app.processors import email_processor as email_processor_module
+from app.processors.email_processor import EmailProcessor
+from app.services.supabase_service import async_supabase_service
+
+class StubEmailService:
+    def __init__(self, error: Exception) -> None:
+        self.error = error
+        self.calls = []
+
+    async def get_email_changes(self, folder_id, delta_link=None):
+        self.calls.append(delta_link)
+        if delta_link:
+            raise self.error
+        return [], "https://graph.microsoft.com/v1.0/delta?$deltatoken=new"
+
+@pytest.fixture(autouse=True)
+def delta_mode(monkeypatch):
+    async def get_delta_link(email, folder_id):
+        return "https://graph.microsoft.com/v1.0/delta?$deltatoken=old"
+
+    monkeypatch.setattr(email_processor_module, "EMAIL_SYNC_MODE", "delta")
+    monkeypatch.setattr(async_supabase_service, "get_delta_link", get_delta_link, raising=False)
+
+@pytest.mark.parametrize("error", [
+    GraphAPIError(410, '{"error": {"code": "Gone"}}'),
+    GraphAPIError(400, '{"error": {"code": "SyncStateNotFound", "message": "..."}}'),
+])
+def test_expired_delta_token_resyncs(error):
+    service = StubEmailService(error)
+
+    emails, delta_link = asyncio.run(EmailProcessor().fetch_emails("a@example.com", service, "inbox-id"))
+
+    assert service.calls == ["https://graph.microsoft.com/v1.0/delta?$deltatoken=old", None]
+    assert delta_link.endswith("deltatoken=new")
+
+def test_other_errors_mentioning_410_do_not_resync():
+    service = StubEmailService(GraphAPIError(500, '{"error": {"code": "InternalServerError", "message": "request 410 failed"}}'))
+
+    with pytest.raises(GraphAPIError):
+        asyncio.run(EmailProcessor().fetch_emails("a@example.com", service, "inbox-id"))
+    assert len(service.calls) == 1
@@ -0,0 +1,41 @@
+import asyncio
+from app.auth.graph_auth import GraphAPIError
+from app.services.email_service import EmailService, filter_personal_folders, folder_cache
+
+GERMAN_FOLDERS = [
+    {"id": "inbox-id", "displayName": "Posteingang"},
+    {"id": "deleted-id", "displayName": "Gelöschte Elemente"},
+    {"id": "junk-id", "displayName": "Junk-E-Mail"},
+    {"id": "clients-id", "displayName": "Kunden"},
+]
+
+class StubGraphAuth:
+    """GraphAuth stand-in resolving well-known folder names through batch"""
+
+    email = "de@example.com"
+
+    def __init__(self, known: dict) -> None:
+        self.known = known
+        self.batches = 0
+
+    async def batch(self, requests: list):
+        self.batches += 1
+        results = []
+        for request in requests:
+            name = request["url"].removeprefix("me/mailFolders/").split("?")[0]
+            if name in self.known:
+                results.append({"id": self.known[name]})
+            else:
+                results.append(GraphAPIError(404, '{"error": {"code": "ErrorFolderNotFound"}}'))
+        return results
+
+def test_localized_default_folders_are_not_sort_targets():
+    auth = StubGraphAuth({"inbox": "inbox-id", "deleteditems": "deleted-id", "junkemail": "junk-id"})
+    service = EmailService(auth)
+    folder_cache.pop((auth.email, "default_folder_ids"))
+
+    default_ids = asyncio.run(service.get_default_folder_ids())
+    asyncio.run(service.get_default_folder_ids())
+
+    assert filter_personal_folders(GERMAN_FOLDERS, default_ids) == [{"id": "clients-id", "displayName": "Kunden"}]
+    assert auth.batches == 1
@@ -0,0 +1,111 @@
+import asyncio
+import httpx
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from config import GRAPH_MAX_REQUESTS_PER_USER
+from app.auth import graph_client as graph_client_module
+from app.auth.graph_client import GraphClient, MailboxLimiter
+from fake_graph import FakeGraph
+
+URL = "http://graph.test/v1.0"
+
+def make_client(fake: FakeGraph):
+    client = GraphClient()
+    client._build_client = lambda: httpx.AsyncClient(transport=httpx.ASGITransport(app=fake))
+    return client
+
+def test_retry_after_is_honored():
+    fake = FakeGraph()
+    fake.script("/v1.0/me/messages", (429, {"Retry-After": "0.3"}))
+    client = make_client(fake)
+
+    response = asyncio.run(client.request("a@example.com", "GET", f"{URL}/me/messages"))
+
+    first, second = fake.hits("/v1.0/me/messages")
+    assert response.status_code == 200
+    assert second[0] - first[0] >= 0.3
+    assert client.counters["throttled"] == 1
+    assert client.counters["retries"] == 1
+
+def test_limit_halves_on_throttling_and_recovers():
+    async def run():
+        limiter = MailboxLimiter()
+        await limiter.acquire()
+        await limiter.release(throttled=True)
+        halved = limiter.limit
+        for _ in range(20):
+            await limiter.acquire()
+            await limiter.release()
+        return halved, limiter.limit
+
+    halved, recovered = asyncio.run(run())
+    assert halved == GRAPH_MAX_REQUESTS_PER_USER / 2
+    assert recovered == GRAPH_MAX_REQUESTS_PER_USER
+
+def test_throttled_mailbox_limit_is_lowered():
+    fake = FakeGraph()
+    fake.script("/v1.0/me", (429, {"Retry-After": "0"}), (429, {"Retry-After": "0"}))
+    client = make_client(fake)
+
+    async def run():
+        await client.request("a@example.com", "GET", f"{URL}/me")
+        return client._limiter("a@example.com").limit, client.stats()
+
+    limit, stats = asyncio.run(run())
+    assert limit < GRAPH_MAX_REQUESTS_PER_USER
+    assert stats["mailboxes_throttled"] == 1
+
+def test_post_gateway_timeout_is_not_retried():
+    fake = FakeGraph()
+    fake.script("/v1.0/me/messages/1/reply", (504, {}))
+    client = make_client(fake)
+
+    response = asyncio.run(client.request("a@example.com", "POST", f"{URL}/me/messages/1/reply"))
+
+    assert response.status_code == 504
+    assert len(fake.hits("/v1.0/me/messages/1/reply")) == 1
+
+def test_post_throttled_is_retried():
+    fake = FakeGraph()
+    fake.script(
+        "/v1.0/me/messages/1/reply",
+        (429, {"Retry-After": "0"}),
+        (503, {"Retry-After": "0"}),
+        (503, {})
+    )
+    client = make_client(fake)
+
+    response = asyncio.run(client.request("a@example.com", "POST", f"{URL}/me/messages/1/reply"))
+
+    # The 503 without Retry-After may have been processed, so it is returned as is
+    assert response.status_code == 503
+    assert len(fake.hits("/v1.0/me/messages/1/reply")) == 3
+
+def test_get_gateway_timeout_is_retried():
+    fake = FakeGraph()
+    fake.script("/v1.0/me", (504, {"Retry-After": "0"}))
+    client = make_client(fake)
+
+    response = asyncio.run(client.request("a@example.com", "GET", f"{URL}/me"))
+
+    assert response.status_code == 200
+    assert len(fake.hits("/v1.0/me")) == 2
+
+def test_metrics_report_graph_counters(monkeypatch):
+    from app.api.routes import router
+
+    fake = FakeGraph()
+    fake.script("/v1.0/me", (429, {"Retry-After": "0"}))
+    client = make_client(fake)
+    monkeypatch.setattr(graph_client_module, "graph_client", client)
+    monkeypatch.setattr("app.api.routes.graph_client", client)
+    asyncio.run(client.request("a@example.com", "GET", f"{URL}/me"))
+
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    graph = TestClient(app).get("/api/metrics").json()["graph"]
+
+    assert graph["requests"] == 2
+    assert graph["throttled"] == 1
+    assert graph["retries"] == 1
+    assert graph["mailboxes_throttled"] == 1
@@ -0,0 +1,41 @@
+import asyncio
+import pytest
+from app.processors import partitioner as partitioner_module
+from app.processors.partitioner import LeasePartitioner
+from app.services.supabase_service import async_supabase_service
+
+@pytest.fixture
+def leases(monkeypatch):
+    state = {"fail": False}
+
+    async def renew_processor_lease(worker_id):
+        if state["fail"]:
+            raise RuntimeError("database unavailable")
+
+    async def get_live_processor_leases(ttl):
+        return []
+
+    monkeypatch.setattr(async_supabase_service, "renew_processor_lease", renew_processor_lease, raising=False)
+    monkeypatch.setattr(async_supabase_service, "get_live_processor_leases", get_live_processor_leases, raising=False)
+    monkeypatch.setattr(partitioner_module, "LEASE_HEARTBEAT_INTERVAL", 0)
+    return state
+
+def test_owns_nothing_until_the_first_heartbeat_succeeds(leases):
+    partitioner = LeasePartitioner()
+    leases["fail"] = True
+    asyncio.run(partitioner.heartbeat())
+    assert not partitioner.owns("a@example.com")
+
+    leases["fail"] = False
+    asyncio.run(partitioner.heartbeat())
+    assert partitioner.owns("a@example.com")
+
+def test_owns_nothing_once_the_lease_expires(leases, monkeypatch):
+    partitioner = LeasePartitioner()
+    asyncio.run(partitioner.heartbeat())
+    leases["fail"] = True
+    asyncio.run(partitioner.heartbeat())
+    assert partitioner.owns("a@example.com")
+
+    monkeypatch.setattr(partitioner_module, "LEASE_TTL", 0)
+    assert not partitioner.owns("a@example.com")
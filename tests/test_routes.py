@@ -0,0 +1,62 @@
+import json
+from fastapi import FastAPI
+from fastapi.testclient import TestClient
+from app.api.auth import get_current_graph
+from app.api.routes import router
+from app.auth.graph_auth import GraphAPIError
+
+def message(message_id: str):
+    return {"id": message_id, "subject": "Hello", "bodyPreview": "", "from": {"emailAddress": {"address": "a@example.com"}}}
+
+class StubGraphAuth:
+    """GraphAuth stand-in answering make_request from a list of pages or errors"""
+
+    email = "user@example.com"
+
+    def __init__(self, *pages) -> None:
+        self.pages = list(pages)
+
+    async def make_request(self, method, endpoint, data=None, params=None, headers=None):
+        page = self.pages.pop(0)
+        if isinstance(page, Exception):
+            raise page
+        return page
+
+def client_for(graph_auth):
+    app = FastAPI()
+    app.include_router(router, prefix="/api")
+    app.dependency_overrides[get_current_graph] = lambda: graph_auth
+    return TestClient(app)
+
+def test_stream_emails_reports_a_failed_page():
+    graph_auth = StubGraphAuth(
+        {"value": [message("1"), message("2")], "@odata.nextLink": "https://graph.microsoft.com/v1.0/next"},
+        GraphAPIError(503, "unavailable")
+    )
+
+    response = client_for(graph_auth).get("/api/emails/stream")
+
+    lines = [json.loads(line) for line in response.text.splitlines()]
+    assert response.status_code == 200
+    assert [line.get("id") for line in lines[:2]] == ["1", "2"]
+    assert "error" in lines[2]
+
+def test_stream_emails_returns_http_errors_for_the_first_page():
+    graph_auth = StubGraphAuth(GraphAPIError(404, '{"error": {"code": "ErrorFolderNotFound"}}'))
+
+    response = client_for(graph_auth).get("/api/emails/stream?folder=missing")
+
+    assert response.status_code == 404
+
+def test_delete_emails_reports_each_result():
+    graph_auth = StubGraphAuth()
+
+    async def batch(requests):
+        assert [request["method"] for request in requests] == ["DELETE", "DELETE"]
+        return [None, GraphAPIError(404, "not found")]
+    graph_auth.batch = batch
+
+    response = client_for(graph_auth).post("/api/emails/delete", json={"email_ids": ["1", "2"]})
+
+    assert response.json()["deleted"] == ["1"]
+    assert list(response.json()["failed"]) == ["2"]